@@ -0,0 +1,63 @@
+"""Recall@k and latency of the IVF backend against the exact scan.
+
+Queries are perturbed copies of random entity embeddings, so the model is
+not needed. Each nprobe setting, and the float16/int8 exact scans, are
+compared with the float32 BruteForceBackend.
+
+    python benchmarks/bench_ann.py [entity] [indexType]
+"""
+import os
+import sys
+import time
+
+import torch
+
+from casbert.general import CURRENT_PATH, RESOURCE_DIR
+from casbert.searcher.backend import BruteForceBackend, IvfBackend, PRECISION_FLOAT16, PRECISION_INT8
+
+TOP_K = 10
+NUM_QUERIES = 200
+NPROBES = [1, 2, 4, 8, 16, 32]
+
+
+def timeSearch(backend, queries, topK):
+    start = time.perf_counter()
+    results = [backend.search(q.unsqueeze(0), topK)[1][0] for q in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(approx, exact):
+    return sum(len(set(a) & set(e)) for a, e in zip(approx, exact)) / (TOP_K * len(exact))
+
+
+def main():
+    entity = sys.argv[1] if len(sys.argv) > 1 else 'variable'
+    indexType = sys.argv[2] if len(sys.argv) > 2 else 'class_predicate'
+    indexes = torch.load(os.path.join(CURRENT_PATH, RESOURCE_DIR, 'casbert_pmr.pt'),
+                         map_location=torch.device('cpu'))
+    embedding = indexes[entity]['embedding'][indexType]
+
+    generator = torch.Generator().manual_seed(0)
+    rows = torch.randint(embedding.shape[0], (NUM_QUERIES,), generator=generator)
+    queries = embedding[rows].float()
+    queries = queries + 0.05 * queries.std() * torch.randn(queries.shape, generator=generator)
+
+    exact, exactMs = timeSearch(BruteForceBackend(embedding), queries, TOP_K)
+    print('%s/%s rows=%d  exact: %.3f ms/query' % (entity, indexType, embedding.shape[0], exactMs))
+
+    for precision in [PRECISION_FLOAT16, PRECISION_INT8]:
+        approx, ms = timeSearch(BruteForceBackend(embedding, precision), queries, TOP_K)
+        print('exact %-7s recall@%d=%.3f  %.3f ms/query' % (precision, TOP_K, recall(approx, exact), ms))
+
+    start = time.perf_counter()
+    ivf = IvfBackend(embedding)
+    print('ivf build: nlist=%d %.2fs' % (ivf.nlist, time.perf_counter() - start))
+    for nprobe in NPROBES:
+        ivf.nprobe = nprobe
+        approx, ms = timeSearch(ivf, queries, TOP_K)
+        print('nprobe=%-3d recall@%d=%.3f  %.3f ms/query  speedup=%.1fx' % (
+            nprobe, TOP_K, recall(approx, exact), ms, exactMs / ms))
+
+
+if __name__ == '__main__':
+    main()
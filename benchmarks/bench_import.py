@@ -0,0 +1,38 @@
+"""Import-time budget for `import casbert`.
+
+Runs `python -X importtime -c "import casbert"` in a fresh interpreter,
+reports the cumulative import time of casbert and fails (exit code 1) if
+it is over budget or if a heavy module is imported eagerly.
+
+    python benchmarks/bench_import.py [budget_ms]
+"""
+import subprocess
+import sys
+
+BUDGET_MS = 250
+# modules that must only be imported when Searcher or Tester is used
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'IPython', 'requests']
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    code = 'import sys, casbert; print(",".join(m for m in %r if m in sys.modules))' % HEAVY_MODULES
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == 'casbert':
+            cumulative = int(parts[1]) / 1000
+    heavy = [m for m in proc.stdout.strip().split(',') if m]
+
+    print('import casbert: %.1f ms (budget %.1f ms)' % (cumulative, budget))
+    if len(heavy) > 0:
+        print('eagerly imported: %s' % ', '.join(heavy))
+    if cumulative > budget or len(heavy) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Resident memory of the Variables, Components and Units data as json
+dictionaries and as compact records (casbert.colls.record), after loading
+and at the peak of loading, which includes the json text being parsed.
+
+Loads resources/listOfVariable.json, listOfComponent.json and
+listOfUnit.json when they exist, otherwise synthetic collections shaped like
+them (--variables sets their size).
+
+    python benchmarks/bench_records.py [--variables 300000]
+"""
+import argparse
+import ctypes
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+
+
+def rssMb():
+    # current, not peak, resident set size; the json dictionaries are
+    # released while records are created
+    with open('/proc/self/statm') as fp:
+        pages = int(fp.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def peakRssMb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def makeSynthetic(directory, numVariables):
+    rng = random.Random(0)
+    units = {'unit%d' % i: {'text': 'unit text %d' % i, 'names': ['u%d' % i, 'unit_%d' % i]}
+             for i in range(2000)}
+    numComponents = max(1, numVariables // 10)
+    variables = {}
+    for i in range(numVariables):
+        varId = 'http://models.cellml.org/w%d/model.cellml#comp%d.v%d' % (i // 500, i // 10, i)
+        variables[varId] = {
+            'name': 'v%d' % i, 'shortName': 'v%d' % (i % 50),
+            'type': rng.choice(['state', 'rate', 'constant', 'computed']),
+            'init': rng.random(), 'rate': float('nan'),
+            'unit': 'unit%d' % rng.randrange(len(units)),
+            'component': 'comp%d' % (i // 10),
+            'math': ['math%d' % rng.randrange(numVariables) for _ in range(rng.randrange(3))],
+            'plot': ['plot%d' % rng.randrange(1000)] if rng.random() < 0.1 else [],
+            'dependent': {'v%d' % j: 'v%d' % j for j in rng.sample(range(numVariables), 2)},
+        }
+    components = {'comp%d' % i: {'name': 'comp%d' % i, 'cellml': 'cellml%d' % (i // 50),
+                                 'variables': ['v%d' % (i * 10 + j) for j in range(10)],
+                                 'cellmlCode': '<component name="comp%d"/>' % i}
+                  for i in range(numComponents)}
+    for name, data in [('listOfVariable.json', variables), ('listOfComponent.json', components),
+                       ('listOfUnit.json', units)]:
+        with open(os.path.join(directory, name), 'w') as fp:
+            json.dump({'data': data}, fp)
+
+
+def load(directory, compact):
+    from casbert.colls import pmrcollection
+    from casbert.colls.variable import Variables
+    from casbert.colls.component import Components
+    from casbert.colls.unit import Units
+    pmrcollection.ensureData = lambda: None
+    if not compact:
+        for cls in [Variables, Components, Units]:
+            cls.RECORD = None
+    return [Units(directory, 'listOfUnit.json'), Components(directory, 'listOfComponent.json'),
+            Variables(None, directory, 'listOfVariable.json')]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variables', type=int, default=300000)
+    parser.add_argument('--mode', choices=['dict', 'record'])
+    parser.add_argument('--directory')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    if args.mode is None:
+        from casbert.general import CURRENT_PATH, RESOURCE_DIR, RS_VARIABLE
+        directory = os.path.join(CURRENT_PATH, RESOURCE_DIR)
+        tmp = None
+        if not os.path.exists(os.path.join(directory, RS_VARIABLE)):
+            tmp = tempfile.TemporaryDirectory()
+            directory = tmp.name
+            makeSynthetic(directory, args.variables)
+            print('synthetic data, %d variables' % args.variables)
+        # each mode runs in its own process, so freed memory is not reused
+        for mode in ['dict', 'record']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--directory', directory],
+                           check=True)
+        return
+    import casbert.colls.variable, casbert.colls.component, casbert.colls.unit  # noqa: F401
+    gc.collect()
+    baseline = rssMb()
+    collections = load(args.directory, args.mode == 'record')
+    gc.collect()
+    rss = rssMb() - baseline
+    # glibc keeps the freed json dictionaries mapped; a long running server
+    # reuses that memory, trimming shows what the data itself keeps
+    ctypes.CDLL('libc.so.6').malloc_trim(0)
+    print('%-6s variables=%d components=%d units=%d rss_delta=%.1fMB trimmed_rss_delta=%.1fMB '
+          'peak_rss_delta=%.1fMB' % (
+              args.mode, len(collections[2].data), len(collections[1].data), len(collections[0].data),
+              rss, rssMb() - baseline, peakRssMb() - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Startup time and memory of building the five PmrIndex encoders.
+
+Compares one SentenceTransformer per PmrIndex (the old behaviour) with the
+shared encoder returned by casbert.searcher.encoder.getEncoder.
+
+    python benchmarks/bench_startup.py
+"""
+import gc
+import resource
+import sys
+import time
+
+from sentence_transformers import SentenceTransformer
+
+NUM_INDEXES = 5  # variable, cellml, sedml, image, component
+
+
+def rssMb():
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def loadSeparate(modelName):
+    return [SentenceTransformer(modelName) for _ in range(NUM_INDEXES)]
+
+
+def loadShared(modelName):
+    from casbert.searcher.encoder import getEncoder, clearEncoders
+    clearEncoders()
+    return [getEncoder(modelName) for _ in range(NUM_INDEXES)]
+
+
+def main():
+    from casbert.searcher.encoder import BERT_MODEL
+    mode = sys.argv[1] if len(sys.argv) > 1 else None
+    if mode is None:
+        # each mode runs in its own process, so peak RSS is not shared
+        import subprocess
+        for m in ['separate', 'shared']:
+            subprocess.run([sys.executable, __file__, m], check=True)
+        return
+    baseline = rssMb()
+    start = time.perf_counter()
+    models = loadSeparate(BERT_MODEL) if mode == 'separate' else loadShared(BERT_MODEL)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print('%-9s models=%d unique=%d time=%.2fs peak_rss_delta=%.1fMB' % (
+        mode, len(models), len({id(m) for m in models}), elapsed, rssMb() - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Concurrency stress test of one Searcher shared by many threads.
+
+Every (search method, query) pair is first run in one thread; then the
+threads run random pairs for the given duration and each result must be
+identical to the single threaded one. Reports errors, mismatches and
+throughput, and exits with 1 if any is found.
+
+    python benchmarks/stress_searcher.py [--threads 16] [--seconds 30]
+
+Without the resources (or with --synthetic) two synthetic cases run:
+- index: fresh PmrIndexes over random matrices and a deterministic
+  stand-in encoder, so lazily built backends, the query cache and the
+  encode scheduler are hit by concurrent first searches;
+- filtered ivf: IVF indexes searched with row masks of a few to many rows,
+  whose results must not be shorter than the allowed rows;
+- searcher: a Searcher over synthetic collections written to a temporary
+  directory, so the result expansion (images merged from similar cellmls,
+  entity classes, sedml plots, ...) runs concurrently on shared data.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+QUERIES = ['basolateral plasma membrane', 'sodium concentration', 'potassium channel current',
+           'calcium release', 'membrane voltage', 'glucose transport', 'cardiac action potential',
+           'insulin secretion']
+METHODS = ['searchVariables', 'searchCellmls', 'searchSedmls', 'searchImages', 'searchComponents',
+           'searchPlots', 'search']
+
+
+class StandInEncoder:
+    """Deterministic encoder, the embedding only depends on the text."""
+
+    def encode(self, queries, convert_to_tensor=True):
+        import torch
+        single = isinstance(queries, str)
+        embeddings = []
+        for query in [queries] if single else queries:
+            generator = torch.Generator().manual_seed(sum(ord(c) * (i + 1) for i, c in enumerate(query)))
+            embeddings += [torch.randn(64, generator=generator)]
+        return embeddings[0] if single else torch.stack(embeddings)
+
+
+def canonical(result):
+    # search adds wall clock timings, which differ per run
+    if isinstance(result, dict) and 'timings' in result:
+        result = result['result']
+    return json.dumps(result, sort_keys=True, default=str)
+
+
+def stress(run, expected, threads, seconds):
+    """Run random tasks of expected ({task: canonical result}) from threads."""
+    tasks = list(expected)
+    counts = {'calls': 0, 'errors': 0, 'mismatches': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        calls = errors = mismatches = 0
+        while time.monotonic() < deadline:
+            task = rng.choice(tasks)
+            try:
+                if canonical(run(*task)) != expected[task]:
+                    mismatches += 1
+            except Exception as e:
+                errors += 1
+                print('error %s: %s: %s' % (task, e.__class__.__name__, e))
+            calls += 1
+        with lock:
+            counts['calls'] += calls
+            counts['errors'] += errors
+            counts['mismatches'] += mismatches
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    counts['callsPerSecond'] = counts['calls'] / (time.perf_counter() - start)
+    return counts
+
+
+def createIndexes(encoder, modelName, rows, seed, cacheSize):
+    import torch
+    from casbert.searcher.searcher import PmrIndex
+    from casbert.searcher.encoder import QueryCache
+    generator = torch.Generator().manual_seed(seed)
+    indexes = {}
+    for name in ['variable', 'cellml', 'sedml', 'image', 'component']:
+        ids = ['%s%d' % (name, i) for i in range(rows)]
+        indexes[name] = PmrIndex({'id': ids, 'class': {}, 'embedding': {
+            'class': torch.randn(rows, 64, generator=generator),
+            'class_predicate': torch.randn(rows, 64, generator=generator)}},
+            encoder, modelName, queryCache=QueryCache(cacheSize))
+    return indexes
+
+
+def runSynthetic(args):
+    from casbert.searcher.encoder import startEncodeScheduler, stopEncodeScheduler
+    encoder, modelName = StandInEncoder(), 'stand-in'
+    tasks = [(name, query, indexType) for name in ['variable', 'cellml', 'sedml', 'image', 'component']
+             for query in QUERIES for indexType in ['class', 'class_predicate']]
+    total = {'calls': 0, 'errors': 0, 'mismatches': 0, 'callsPerSecond': 0.0}
+    for round in range(args.rounds):
+        # expected results from single threaded indexes over the same matrices
+        reference = createIndexes(encoder, modelName, args.rows, round, 0)
+        expected = {task: canonical(reference[task[0]].searchEntities(task[1], 20, -1.0, task[2]))
+                    for task in tasks}
+        if args.encodeWindow:
+            startEncodeScheduler(modelName, encoder, maxWait=0.003, maxBatchSize=32)
+        # fresh indexes, so the first searches, which build the backends, are concurrent
+        indexes = createIndexes(encoder, modelName, args.rows, round, 256)
+        counts = stress(lambda name, query, indexType: indexes[name].searchEntities(
+            query, 20, -1.0, indexType), expected, args.threads, args.seconds / args.rounds)
+        stopEncodeScheduler(modelName)
+        for key in ['calls', 'errors', 'mismatches']:
+            total[key] += counts[key]
+        total['callsPerSecond'] += counts['callsPerSecond'] / args.rounds
+    return total
+
+
+def runSyntheticFiltered(args):
+    """Filtered searches of IVF indexes, over masks from a few rows to half of them.
+
+    Besides matching the single threaded results, each result must hold
+    min(20, allowed rows) entities, and for masks allowing 20 rows or fewer
+    the same entities as the exact backend, so selective filters are not cut
+    short by the probed lists.
+    """
+    import torch
+    from casbert.searcher.searcher import PmrIndex
+    from casbert.searcher.backend import BACKEND_IVF, BACKEND_EXACT
+    encoder, modelName = StandInEncoder(), 'stand-in'
+    total = {'calls': 0, 'errors': 0, 'mismatches': 0, 'short': 0, 'callsPerSecond': 0.0}
+    for round in range(args.rounds):
+        generator = torch.Generator().manual_seed(round)
+        embedding = torch.randn(args.rows, 64, generator=generator)
+        masks = {}
+        for allowed in [1, 10, 20, args.rows // 100, args.rows // 10, args.rows // 2]:
+            mask = torch.zeros(args.rows, dtype=torch.bool)
+            mask[torch.randperm(args.rows, generator=generator)[:allowed]] = True
+            masks[allowed] = mask
+
+        def createIndex(backend):
+            return PmrIndex({'id': ['variable%d' % i for i in range(args.rows)], 'class': {},
+                             'embedding': {'class': embedding.clone()}}, encoder, modelName,
+                            backend=backend, backendParams={'nprobe': 2} if backend == BACKEND_IVF else {})
+
+        exact, reference = createIndex(BACKEND_EXACT), createIndex(BACKEND_IVF)
+        expected = {}
+        for query in QUERIES:
+            for allowed, mask in masks.items():
+                result = reference.searchEntities(query, 20, -1.0, 'class', mask)
+                if len(result) != min(20, allowed) or (allowed <= 20 and sorted(result) != sorted(
+                        exact.searchEntities(query, 20, -1.0, 'class', mask))):
+                    total['short'] += 1
+                expected[(query, allowed)] = canonical(result)
+        index = createIndex(BACKEND_IVF)
+        counts = stress(lambda query, allowed: index.searchEntities(query, 20, -1.0, 'class', masks[allowed]),
+                        expected, args.threads, args.seconds / args.rounds)
+        for key in ['calls', 'errors', 'mismatches']:
+            total[key] += counts[key]
+        total['callsPerSecond'] += counts['callsPerSecond'] / args.rounds
+    return total
+
+
+def makeSyntheticResources(directory, numCellmls, seed):
+    """Write collection json files shaped like the resources to directory.
+
+    Two cellmls share each workspace and its image paths. The last cellml of
+    each cluster of four lists no images, so it gets those of the others,
+    with the meta of the images shared by a workspace merged.
+    Returns the entity ids of each index and the classes of the variables.
+    """
+    from casbert.general import RS_UNIT, RS_MATH, RS_SEDML, RS_VARIABLE, RS_COMPONENT, RS_WORKSPACE, \
+        RS_CELLML, RS_IMAGE, RS_CLUSTERER
+    rng = random.Random(seed)
+    units = {'u%d' % i: {'text': 'unit text %d' % i, 'names': ['unit%d' % i]} for i in range(20)}
+    workspaces, cellmls, images, sedmls, components, variables = {}, {}, {}, {}, {}, {}
+    classes, clusterer = {}, {'url2Cluster': {}, 'cluster': {}}
+    for c in range(numCellmls):
+        wksUrl = 'workspace/w%d' % (c // 2)
+        workspaces[wksUrl] = {'id': 'w%d' % (c // 2), 'cellml': [],
+                              'exposures': {'exposure/e%d' % (c // 2): {}}}
+        url = '%s/rawfile/HEAD/m%d.cellml' % (wksUrl, c)
+        workspaces[wksUrl]['cellml'] += [url]
+        cellmlImages = []
+        if c % 4 != 3:
+            for j in range(2):
+                imageId = 'img%d_%d' % (c, j)
+                images[imageId] = {'path': 'figure%d.png' % j, 'title': 'Figure %d' % j,
+                                   'cellml': 'c%d' % c, 'status': 1}
+                cellmlImages += [imageId]
+        cellmls[url] = {'id': 'c%d' % c, 'workingDir': 'w%d' % (c // 2), 'cellml': 'm%d.cellml' % c,
+                        'workspace': wksUrl, 'images': cellmlImages, 'sedml': ['s%d' % c],
+                        'modelInfo': {'title': 'Model %d' % c}}
+        clusterId = 'k%d' % (c // 4)
+        clusterer['url2Cluster'][url] = clusterId
+        clusterer['cluster'].setdefault(clusterId, []).append(url)
+        compVars = []
+        for k in range(3):
+            compId = 'comp%d_%d' % (c, k)
+            varIds = ['var%d_%d_%d' % (c, k, v) for v in range(5)]
+            components[compId] = {'name': 'component%d' % k, 'cellml': 'c%d' % c, 'variables': varIds}
+            for varId in varIds:
+                variables[varId] = {'name': varId, 'shortName': varId.split('_')[-1],
+                                    'type': rng.choice(['state', 'computed', 'constant']),
+                                    'init': rng.random(), 'rate': rng.random(),
+                                    'unit': 'u%d' % rng.randrange(len(units)), 'component': compId,
+                                    'plot': ['s%d.plot1' % c] if rng.random() < 0.3 else [],
+                                    'dependent': {}}
+                classes[varId] = {'classes': {'CL:%d' % i: {'name': 'class %d' % i}
+                                              for i in rng.sample(range(30), 2)}}
+            compVars += varIds
+        sedmls['%s/sim%d.sedml' % (wksUrl, c)] = {
+            'id': 's%d' % c, 'workspace': wksUrl, 'models': {'model': 'c%d' % c},
+            'outputs': {'plot1': [{'x': compVars[0], 'y': compVars[1]}]},
+            'variables': {compVars[0]: 0.0, compVars[1]: 1.0}}
+    for name, data in [(RS_UNIT, units), (RS_MATH, {}), (RS_SEDML, sedmls), (RS_VARIABLE, variables),
+                       (RS_COMPONENT, components), (RS_WORKSPACE, workspaces), (RS_CELLML, cellmls),
+                       (RS_IMAGE, images)]:
+        with open(os.path.join(directory, name), 'w') as fp:
+            json.dump({'data': data}, fp)
+    with open(os.path.join(directory, RS_CLUSTERER), 'w') as fp:
+        json.dump(clusterer, fp)
+    ids = {'variable': list(variables), 'cellml': list(cellmls), 'sedml': [v['id'] for v in sedmls.values()],
+           'image': list(images), 'component': list(components)}
+    return ids, classes
+
+
+def createSyntheticSearcher(directory, encoder, modelName, numCellmls, seed):
+    import torch
+    import casbert.general
+    from casbert.general import RS_UNIT, RS_MATH, RS_SEDML, RS_VARIABLE, RS_COMPONENT, RS_WORKSPACE, \
+        RS_CELLML, RS_IMAGE, RS_CLUSTERER, loadJson
+    from casbert.searcher.searcher import Searcher, PmrIndex
+    from casbert.colls.unit import Units
+    from casbert.colls.equation import Maths
+    from casbert.colls.sedml import Sedmls
+    from casbert.colls.variable import Variables
+    from casbert.colls.component import Components
+    from casbert.colls.workspace import Workspaces
+    from casbert.colls.cellml import Cellmls
+    from casbert.colls.image import Images
+    # the collections are read from directory, the packaged data is not needed
+    setattr(casbert.general, '__isDataExtracted', True)
+    ids, classes = makeSyntheticResources(directory, numCellmls, seed)
+    generator = torch.Generator().manual_seed(seed)
+    searcher = Searcher(model=encoder, modelName=modelName)
+    # collections and indexes take the place of the lazily loaded attributes;
+    # absolute paths make the collections read directory
+    maths = Maths(directory, RS_MATH)
+    loaded = {'sysUnits': Units(directory, RS_UNIT), 'sysMaths': maths,
+              'sysSedmls': Sedmls(directory, RS_SEDML), 'sysVars': Variables(maths, directory, RS_VARIABLE),
+              'sysComps': Components(directory, RS_COMPONENT), 'sysWks': Workspaces(directory, RS_WORKSPACE),
+              'sysCellmls': Cellmls(directory, RS_CELLML), 'sysImages': Images(directory, RS_IMAGE),
+              'clusterer': loadJson(directory, RS_CLUSTERER), 'resultCards': None}
+    for name, (idxName, _) in Searcher.ENTITY_INDEXES.items():
+        rows = len(ids[name])
+        loaded[idxName] = PmrIndex({'id': ids[name], 'class': classes if name == 'variable' else {},
+                                    'embedding': {'class': torch.randn(rows, 64, generator=generator),
+                                                  'class_predicate': torch.randn(rows, 64, generator=generator)}},
+                                   encoder, modelName)
+    searcher.__dict__.update(loaded)
+    return searcher
+
+
+def runSyntheticSearcher(args):
+    encoder, modelName = StandInEncoder(), 'stand-in'
+    total = {'calls': 0, 'errors': 0, 'mismatches': 0, 'callsPerSecond': 0.0}
+    for round in range(args.rounds):
+        with tempfile.TemporaryDirectory() as directory:
+            # expected results from a single threaded searcher over the same data
+            reference = createSyntheticSearcher(directory, encoder, modelName, args.cellmls, round)
+
+            def runReference(method, query):
+                return getattr(reference, method)(query, top=10, minSim=-1.0)
+
+            expected = {(method, query): canonical(runReference(method, query))
+                        for method in METHODS for query in QUERIES}
+            # a fresh searcher, so the first searches build its backends concurrently
+            searcher = createSyntheticSearcher(directory, encoder, modelName, args.cellmls, round)
+            counts = stress(lambda method, query: getattr(searcher, method)(query, top=10, minSim=-1.0),
+                            expected, args.threads, args.seconds / args.rounds)
+        for key in ['calls', 'errors', 'mismatches']:
+            total[key] += counts[key]
+        total['callsPerSecond'] += counts['callsPerSecond'] / args.rounds
+    return total
+
+
+def runSearcher(args):
+    from casbert.searcher.searcher import Searcher
+    searcher = Searcher(encodeWindow={'maxWait': 0.003, 'maxBatchSize': 32} if args.encodeWindow else None)
+    searcher.warmup()
+
+    def run(method, query):
+        return getattr(searcher, method)(query, top=10, minSim=0.3)
+
+    expected = {(method, query): canonical(run(method, query)) for method in METHODS for query in QUERIES}
+    return stress(run, expected, args.threads, args.seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per synthetic index')
+    parser.add_argument('--rounds', type=int, default=10, help='synthetic rounds of fresh indexes')
+    parser.add_argument('--cellmls', type=int, default=200, help='cellmls of the synthetic collections')
+    parser.add_argument('--encode-window', dest='encodeWindow', action='store_true',
+                        help='encode through an EncodeScheduler')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from casbert.general import CURRENT_PATH, RESOURCE_DIR, RS_VARIABLE
+    synthetic = args.synthetic or not os.path.exists(os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_VARIABLE))
+    if synthetic:
+        runs = [('synthetic index', runSynthetic), ('synthetic filtered ivf', runSyntheticFiltered),
+                ('synthetic searcher', runSyntheticSearcher)]
+    else:
+        runs = [('searcher', runSearcher)]
+    isFailed = False
+    for name, run in runs:
+        counts = run(args)
+        print('%s threads=%d %s' % (name, args.threads, counts))
+        isFailed = isFailed or counts['errors'] > 0 or counts['mismatches'] > 0 or counts.get('short', 0) > 0
+    sys.exit(1 if isFailed else 0)
+
+
+if __name__ == '__main__':
+    main()
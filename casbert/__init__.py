@@ -1,7 +1,25 @@
-# extract the required data
-from .general import updateIndexes, __extractData, __loadData
-__extractData()
-__loadData()
+# resource data is extracted and the XSLT stylesheets are compiled on first use,
+# see general.ensureData and general.__loadData
+from .general import updateIndexes, ensureData
 
-from .searcher.searcher import Searcher
-from .tester.tester import Tester
\ No newline at end of file
+# Searcher and Tester import torch, sentence_transformers and IPython,
+# so they are only imported when first accessed
+__lazyAttributes = {
+    'Searcher': ('.searcher.searcher', 'Searcher'),
+    'AsyncSearcher': ('.searcher.asyncsearcher', 'AsyncSearcher'),
+    'Tester': ('.tester.tester', 'Tester'),
+}
+
+
+def __getattr__(name):
+    if name in __lazyAttributes:
+        import importlib
+        moduleName, attrName = __lazyAttributes[name]
+        value = getattr(importlib.import_module(moduleName, __name__), attrName)
+        globals()[name] = value
+        return value
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(__lazyAttributes.keys()))
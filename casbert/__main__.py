@@ -0,0 +1,84 @@
+import argparse
+import sys
+
+
+def renderMathsCommand(args):
+    from .general import RESOURCE_DIR, RS_MATH, MATH_FORMAT
+    from .colls.equation import Maths
+    formats = [MATH_FORMAT[f.upper()] for f in args.formats]
+    maths = Maths(RESOURCE_DIR, RS_MATH, renderPath=args.output)
+    report = maths.prefillRenderStore(formats=formats, processes=args.processes,
+                                      chunkSize=args.chunk_size, verbose=True)
+    for id, format, error in report['failures']:
+        print('failed %s %s: %s' % (id, format.name, error))
+
+
+def convertCollectionsCommand(args):
+    from .general import RESOURCE_DIR, RS_UNIT, RS_MATH, RS_SEDML, RS_VARIABLE, RS_COMPONENT, \
+        RS_WORKSPACE, RS_CELLML, RS_IMAGE
+    from .colls.unit import Units
+    from .colls.equation import Maths
+    from .colls.sedml import Sedmls
+    from .colls.variable import Variables
+    from .colls.component import Components
+    from .colls.workspace import Workspaces
+    from .colls.cellml import Cellmls
+    from .colls.image import Images
+    collections = [(Units, RS_UNIT), (Maths, RS_MATH), (Sedmls, RS_SEDML), (Variables, RS_VARIABLE),
+                   (Components, RS_COMPONENT), (Workspaces, RS_WORKSPACE), (Cellmls, RS_CELLML),
+                   (Images, RS_IMAGE)]
+    for cls, file in collections:
+        print('... converting %s' % file)
+        cls.convertToStore(RESOURCE_DIR, file)
+
+
+def serveCommand(args):
+    from .server import serve
+    from .searcher.searcher import Searcher
+    algorithms = {'casbert': Searcher.ALG_CASBERT, 'bm25': Searcher.ALG_BM25, 'hybrid': Searcher.ALG_HYBRID}
+    encodeWindow = None if args.encode_window_ms is None else \
+        {'maxWait': args.encode_window_ms / 1000, 'maxBatchSize': 32}
+    serve(args.host, args.port, workers=args.workers, torchThreads=args.torch_threads, verbose=args.verbose,
+          requestThreads=args.request_threads, algorithm=algorithms[args.algorithm], backend=args.backend, encodeWindow=encodeWindow)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='casbert')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    render = subparsers.add_parser(
+        'render-maths', help='pre-render every equation of listOfMath.json into the math render store')
+    render.add_argument('--formats', nargs='+', default=['web', 'jupyter', 'latex'],
+                        choices=['web', 'jupyter', 'latex'])
+    render.add_argument('--processes', type=int, default=None,
+                        help='worker processes, defaults to the number of cores')
+    render.add_argument('--chunk-size', type=int, default=64)
+    render.add_argument('--output', default=None,
+                        help='render store path, defaults to resources/mathRender.sqlite')
+    render.set_defaults(func=renderMathsCommand)
+
+    convert = subparsers.add_parser(
+        'convert-collections', help='convert the listOf*.json collections to SQLite stores read on demand')
+    convert.set_defaults(func=convertCollectionsCommand)
+
+    server = subparsers.add_parser(
+        'serve', help='serve searches over HTTP/JSON from workers forked after loading the indexes')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8000)
+    server.add_argument('--workers', type=int, default=None,
+                        help='worker processes, defaults to the number of cores')
+    server.add_argument('--torch-threads', type=int, default=1, help='torch threads per worker')
+    server.add_argument('--request-threads', type=int, default=8, help='threads answering requests per worker')
+    server.add_argument('--algorithm', default='casbert', choices=['casbert', 'bm25', 'hybrid'])
+    server.add_argument('--backend', default='exact', choices=['exact', 'ivf'])
+    server.add_argument('--encode-window-ms', type=float, default=None,
+                        help='encode the queries of concurrent requests together within this window')
+    server.add_argument('--verbose', action='store_true', help='log every request')
+    server.set_defaults(func=serveCommand)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
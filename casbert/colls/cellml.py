@@ -6,13 +6,15 @@ from lxml import etree
 
 
 class Cellmls(PmrCollection):
+    INDEXES = {
+        'id2Url': lambda k, v: v['id'],
+        'local2Url': lambda k, v: v['workingDir'] + '/' + v['cellml'],
+    }
+
     def __init__(self, *paths):
         super().__init__(*paths)
         self.statusC = {'deprecated': 0, 'current': 1,
                         'validating': 2, 'invalid': 3}
-        self.id2Url = {v['id']: k for k, v in self.data.items()}
-        self.local2Url = {v['workingDir']+'/' +
-                          v['cellml']: k for k, v in self.data.items()}
 
     def getUrl(self, localPath=None, id=None):
         if localPath != None:
@@ -48,11 +50,11 @@ class Cellmls(PmrCollection):
 
     def getImages(self, url=None, localPath=None, id=None):
         objData = self.getObjData(url=url, localPath=localPath, id=id)
-        return objData['images'] if 'images' in objData else []
+        return list(objData['images']) if 'images' in objData else []
 
     def getSedmls(self, url=None, localPath=None, id=None):
         objData = self.getObjData(url=url, localPath=localPath, id=id)
-        return objData['sedml'] if 'sedml' in objData else []
+        return list(objData['sedml']) if 'sedml' in objData else []
 
     def getTitle(self, url=None, localPath=None, id=None):
         objData = self.getObjData(url=url, localPath=localPath, id=id)
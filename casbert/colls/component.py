@@ -1,8 +1,17 @@
 from .pmrcollection import PmrCollection
+from .record import Record
 from ..general import MATH_FORMAT
 
 
+class ComponentRecord(Record):
+    FIELDS = ('name', 'cellml', 'variables', 'cellmlCode')
+    __slots__ = FIELDS
+    INTERNED = ('name', 'cellml', 'variables')
+
+
 class Components(PmrCollection):
+    RECORD = ComponentRecord
+
     def __init__(self, *paths):
         super().__init__(*paths)
 
@@ -13,8 +22,9 @@ class Components(PmrCollection):
         # return {v['name']:k for k,v in self.data.items()}
 
     def getVariables(self, compId):
+        # records keep lists as tuples, callers get a list of their own
         if 'variables' in self.data[compId]:
-            return self.data[compId]['variables']
+            return list(self.data[compId]['variables'])
         else:
             # some components such as parent components may not have variables
             # but they have children components which may have variable
@@ -1,17 +1,195 @@
 from .pmrcollection import PmrCollection
-from ..general import MATH_FORMAT, m_c2p, mml2tex
+from .store import SqliteConnections, fileFingerprint
+from ..general import MATH_FORMAT, m_c2p, mml2tex, LruCache
+from ..general import CURRENT_PATH, RESOURCE_DIR, RS_MATH_RENDER, __loadData
+import multiprocessing
+import json
+import os
+import time
+import warnings
+
+
+# formats rendered by renderMaths unless given
+RENDER_FORMATS = [MATH_FORMAT.WEB, MATH_FORMAT.JUPYTER, MATH_FORMAT.LATEX]
+
+
+class MathRenderStore:
+    """Persistent tier of rendered maths, an SQLite file keyed by (math id, format).
+
+    The meta table keeps the fileFingerprint of the listOfMath.json the maths
+    were rendered from, so renders of replaced maths are recognised as stale.
+    """
+
+    def __init__(self, path, readOnly=True):
+        self.path = path
+        self.readOnly = readOnly
+        self.__connections = SqliteConnections(path, readOnly)
+        if not readOnly:
+            conn = self.__getConnection()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS renders (id TEXT, format INTEGER, text TEXT, PRIMARY KEY (id, format)) WITHOUT ROWID')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.commit()
+
+    def __getConnection(self):
+        return self.__connections.get()
+
+    def get(self, id, format):
+        row = self.__getConnection().execute(
+            'SELECT text FROM renders WHERE id = ? AND format = ?', (id, format.value)).fetchone()
+        return row[0] if row is not None else None
+
+    def getSource(self):
+        """Fingerprint of the maths the store was rendered from, None if unknown."""
+        conn = self.__getConnection()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone() is None:
+            return None
+        row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def setSource(self, source):
+        """Record the fingerprint of the maths; renders of other maths are removed."""
+        conn = self.__getConnection()
+        if self.getSource() != source:
+            conn.execute('DELETE FROM renders')
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (json.dumps(source),))
+        conn.commit()
+
+    def putMany(self, items):
+        """Store (id, format, text) items."""
+        conn = self.__getConnection()
+        conn.executemany('INSERT OR REPLACE INTO renders VALUES (?, ?, ?)',
+                         ((id, format.value, text) for id, format, text in items))
+        conn.commit()
 
 
 class Maths(PmrCollection):
-    def __init__(self, *paths):
+    def __init__(self, *paths, cacheSize=4096, renderPath=None):
+        """cacheSize ==> number of rendered maths kept in memory, 0 disables it
+        renderPath ==> persistent render store, read first when it exists and was
+                       rendered from the current maths; defaults to resources/mathRender.sqlite
+        """
         super().__init__(*paths)
+        self.cache = LruCache(cacheSize)
+        self.renderPath = renderPath if renderPath is not None else os.path.join(
+            CURRENT_PATH, RESOURCE_DIR, RS_MATH_RENDER)
+        self.renderStore = self.__openRenderStore()
+
+    def __getSource(self):
+        return fileFingerprint(os.path.join(CURRENT_PATH, *self.paths))
+
+    def __openRenderStore(self):
+        # renders made before the maths changed (e.g. by updateIndexes) are stale,
+        # the maths are rendered on demand instead
+        if not os.path.exists(self.renderPath):
+            return None
+        store = MathRenderStore(self.renderPath)
+        source = self.__getSource()
+        if source is not None and store.getSource() != source:
+            warnings.warn('%s was not rendered from the current maths, run casbert render-maths again' %
+                          self.renderPath)
+            return None
+        return store
 
     def getText(self, id, format=MATH_FORMAT.CODE):
         if format == MATH_FORMAT.CODE:
             return self.data[id]
+        text = self.cache.get((id, format))
+        if text is None and self.renderStore is not None:
+            text = self.renderStore.get(id, format)
+        if text is None:
+            text = self.renderText(self.data[id], format)
+        self.cache.put((id, format), text)
+        return text
+
+    @staticmethod
+    def renderText(math, format):
+        """Convert content MathML math to format, without any caching."""
         if format in [MATH_FORMAT.WEB, MATH_FORMAT.JUPYTER]:
-            return m_c2p(self.data[id], format)
+            return m_c2p(math, format)
         if format == MATH_FORMAT.LATEX:
-            mathP = m_c2p(self.data[id], MATH_FORMAT.JUPYTER)
+            mathP = m_c2p(math, MATH_FORMAT.JUPYTER)
             return mml2tex(mathP)[1:-1]
         return ''
+
+    def prefillRenderStore(self, formats=None, processes=None, chunkSize=64, verbose=False):
+        """Render every math in formats into the persistent store and open it.
+
+        Rendering runs in a process pool, see renderMaths. Returns its report.
+        formats defaults to RENDER_FORMATS.
+        """
+        report = renderMaths(self.data, self.renderPath, formats, processes, chunkSize, verbose,
+                             source=self.__getSource())
+        self.renderStore = MathRenderStore(self.renderPath)
+        return report
+
+
+__workerError = None
+
+
+def __initRenderWorker():
+    # the transformers are inherited from the parent when workers are forked,
+    # otherwise compiled once per worker; an initializer that raises makes the
+    # pool respawn workers forever, so the error is raised by the first task
+    global __workerError
+    try:
+        __loadData()
+    except Exception as e:
+        __workerError = e
+
+
+def __renderChunk(task):
+    if __workerError is not None:
+        raise __workerError
+    format, items = task
+    rendered, failed = [], []
+    start = time.perf_counter()
+    for id, math in items:
+        try:
+            rendered += [(id, format, Maths.renderText(math, format))]
+        except Exception as e:
+            failed += [(id, format, '%s: %s' % (e.__class__.__name__, e))]
+    return format, rendered, failed, time.perf_counter() - start
+
+
+def renderMaths(maths, renderPath, formats=None, processes=None, chunkSize=64, verbose=False, source=None):
+    """Render maths ({id: content MathML}) to formats in parallel into renderPath.
+
+    Equations that fail to convert are reported and skipped, they do not
+    stop the run. Returns a report with, per format, the number of rendered
+    and failed equations, the worker time and the throughput
+    (equations per worker second), plus the wall time and the failures.
+
+    formats ==> MATH_FORMATs to render, defaults to RENDER_FORMATS
+    source ==> fileFingerprint of the maths file, recorded in the store; renders
+               of a store recorded for other maths are removed first
+    """
+    formats = formats if formats is not None else RENDER_FORMATS
+    # compile ctopff.xsl and mmltex.xsl here, so a missing or broken stylesheet
+    # fails before any worker starts
+    __loadData()
+    store = MathRenderStore(renderPath, readOnly=False)
+    store.setSource(source)
+    items = list(maths.items())
+    tasks = [(format, items[i:i+chunkSize]) for format in formats
+             for i in range(0, len(items), chunkSize)]
+    report = {'formats': {format.name: {'rendered': 0, 'failed': 0, 'seconds': 0.0}
+                          for format in formats}, 'failures': []}
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes, initializer=__initRenderWorker) as pool:
+        for format, rendered, failed, seconds in pool.imap_unordered(__renderChunk, tasks):
+            store.putMany(rendered)
+            stats = report['formats'][format.name]
+            stats['rendered'] += len(rendered)
+            stats['failed'] += len(failed)
+            stats['seconds'] += seconds
+            report['failures'] += failed
+    report['wallSeconds'] = time.perf_counter() - start
+    for name, stats in report['formats'].items():
+        stats['perSecond'] = stats['rendered'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        if verbose:
+            print('%-8s rendered=%d failed=%d %.1f eq/s per worker' % (
+                name, stats['rendered'], stats['failed'], stats['perSecond']))
+    if verbose:
+        print('wall time %.1fs, %d failures' % (report['wallSeconds'], len(report['failures'])))
+    return report
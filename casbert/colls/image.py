@@ -1,4 +1,5 @@
 from .pmrcollection import PmrCollection
+from .record import freeze
 
 
 class Images(PmrCollection):
@@ -20,5 +21,5 @@ class Images(PmrCollection):
 
     def getData(self, id):
         if self.isAvailable(id):
-            return self.data[id]
+            return freeze(self.data[id])
         return {}
@@ -1,15 +1,135 @@
-from ..general import loadJson, dumpJson
+from ..general import loadJson, dumpJson, ensureData, CURRENT_PATH
+from .store import RecordStore, getStorePath, convertToStore, fileFingerprint
+from .record import toJson, loadJsonRecords, freeze
+from collections.abc import Mapping
 import copy
 import os
+import sys
+import warnings
 
 class PmrCollection:
+    # declared secondary indexes, {attribute name: function(key, record)}
+    # returning the index key of a record, a list of index keys, or None;
+    # each index maps index keys to data keys and is built once at load
+    INDEXES = {}
+    # optional Record subclass replacing the json dictionaries of data
+    RECORD = None
+
     def __init__(self, *paths):
-        self.dataDict = loadJson(*paths)
+        ensureData()
         self.paths = paths
+        # a collection store converted with convertToStore is read on demand,
+        # otherwise the whole json file is loaded
+        store = self.__openStore(os.path.join(CURRENT_PATH, *paths))
+        if store is not None:
+            self.store = store
+            self.dataDict = self.store.getMeta()
+            self.dataDict['data'] = self.store
+        elif self.RECORD is not None:
+            self.store = None
+            self.dataDict = loadJsonRecords(os.path.join(CURRENT_PATH, *paths), self.RECORD)
+        else:
+            self.store = None
+            self.dataDict = loadJson(*paths)
         if len(self.dataDict)==0:
             self.dataDict['data'] = {}
         self.statusC = {}
         self.data = self.dataDict['data']
+        self.buildIndexes()
+
+    def __openStore(self, jsonPath):
+        # a store converted before the json file changed (e.g. by updateIndexes)
+        # is stale, the json file is loaded instead
+        storePath = getStorePath(jsonPath)
+        if not os.path.exists(storePath):
+            return None
+        store = RecordStore(storePath)
+        source = fileFingerprint(jsonPath)
+        if source is not None and store.getSource() != source:
+            warnings.warn('%s was not converted from the current %s, run casbert convert-collections again' % (
+                storePath, jsonPath))
+            return None
+        return store
+
+    def _checkWritable(self):
+        if getattr(self, 'store', None) is not None:
+            raise RuntimeError('%s is read only, it is read from the collection store %s; remove the store '
+                               'to modify the json file' % (self.__class__.__name__, self.store.path))
+
+    @classmethod
+    def convertToStore(cls, *paths):
+        """Convert the json file at paths to a collection store next to it.
+
+        The store holds the declared indexes too, so loading it does not
+        scan the records. Records of a store backed collection are read
+        only, mutating methods such as addRdf need the json file.
+        """
+        collection = cls.__new__(cls)
+        collection.dataDict = loadJson(*paths)
+        collection.data = collection.dataDict.get('data', {})
+        PmrCollection.buildIndexes(collection)
+        indexes = {name: getattr(collection, name) for name in cls.INDEXES}
+        jsonPath = os.path.join(CURRENT_PATH, *paths)
+        return convertToStore(collection.dataDict, getStorePath(jsonPath), indexes, fileFingerprint(jsonPath))
+
+    def __getIndexKeys(self, getKey, key, record):
+        try:
+            indexKeys = getKey(key, record)
+        except (KeyError, TypeError):
+            return []
+        if indexKeys is None:
+            return []
+        return indexKeys if isinstance(indexKeys, (list, tuple)) else [indexKeys]
+
+    def buildIndexes(self):
+        """Build every declared index in one pass over data."""
+        if getattr(self, 'store', None) is not None:
+            stored = {name: self.store.getIndex(name) for name in self.INDEXES}
+            if all(index is not None for index in stored.values()):
+                for name, index in stored.items():
+                    setattr(self, name, index)
+                return
+        indexes = {name: {} for name in self.INDEXES}
+        for key, record in self.data.items():
+            for name, getKey in self.INDEXES.items():
+                for indexKey in self.__getIndexKeys(getKey, key, record):
+                    indexes[name][indexKey] = key
+        for name, index in indexes.items():
+            setattr(self, name, index)
+
+    def getIndexMemory(self):
+        """Approximate bytes used by each declared index.
+
+        Counts the dictionary and its index key strings; the values are
+        the data keys, which are shared with data and not counted.
+        """
+        memory = {}
+        for name in self.INDEXES:
+            index = getattr(self, name)
+            if not isinstance(index, dict):
+                # kept in the collection store, not in memory
+                memory[name] = 0
+                continue
+            memory[name] = sys.getsizeof(index) + sum(
+                sys.getsizeof(indexKey) for indexKey in index)
+        return memory
+
+    def indexRecord(self, key):
+        """Add data[key] to the declared indexes, call after it is added or changed."""
+        self._checkWritable()
+        for name, getKey in self.INDEXES.items():
+            index = getattr(self, name)
+            for indexKey in self.__getIndexKeys(getKey, key, self.data[key]):
+                index[indexKey] = key
+
+    def unindexRecord(self, key):
+        """Remove data[key] from the declared indexes, call before it is changed or removed."""
+        self._checkWritable()
+        for name, getKey in self.INDEXES.items():
+            index = getattr(self, name)
+            for indexKey in self.__getIndexKeys(getKey, key, self.data[key]):
+                if index.get(indexKey) == key:
+                    del index[indexKey]
 
     def getJson(self):
         return self.dataDict
@@ -17,10 +137,10 @@ class PmrCollection:
     def dumpJson(self):
         self.dataDict['status'] = self.statusC
         for k, v in self.dataDict['data'].items():
-            if isinstance(v,dict):
+            if isinstance(v,Mapping):
                 self.dataDict['vars'] = list(v.keys())
             break
-        dumpJson(self.dataDict, *self.paths)
+        dumpJson({**self.dataDict, 'data': {k: toJson(v) for k, v in self.data.items()}}, *self.paths)
 
     def getStatus(self):
         return self.dataDict['status']
@@ -29,17 +149,19 @@ class PmrCollection:
         return self.data
 
     def getObjData(self, id, items=[], isCopy=False):
+        # a read-only view of the stored object and its nested values, which
+        # are shared between threads; isCopy returns a copy that can be modified
         if not isCopy:
-            return self.data[id]
+            return freeze(self.data[id])
         if len(items) == 0:
-            return copy.deepcopy(self.data[id])
+            return copy.deepcopy(toJson(self.data[id]))
         retObj = {}
         for item in items:
             if item in self.data[id]:
                 if item == 'rdfLeaves':
                     retObj[item] = self.getObjLeaves(id)
                 else:
-                    retObj[item] = self.data[id][item]
+                    retObj[item] = copy.deepcopy(toJson(self.data[id][item]))
 
         return retObj
 
@@ -56,6 +178,8 @@ class PmrCollection:
         return self.__class__.__name__[:3]+'Id-'+str(len(self.data))
 
     def addRdf(self, id, rdf, rdfLeaves, cmeta):
+        self._checkWritable()
+        self.unindexRecord(id)
         if 'rdf' not in self.data[id]:
             self.data[id]['rdf'] = []
         if 'rdfLeaves' not in self.data[id]:
@@ -63,6 +187,7 @@ class PmrCollection:
         self.data[id]['rdf'] += rdf
         self.data[id]['rdfLeaves'] += rdfLeaves
         self.data[id]['cmeta'] = cmeta
+        self.indexRecord(id)
 
     def getCMeta(self, id):
         if 'cmeta' in self.data[id]:
@@ -0,0 +1,187 @@
+from collections.abc import Mapping
+from json.decoder import JSONDecoder, JSONDecodeError, WHITESPACE, scanstring
+import os
+import sys
+
+
+def internValue(value):
+    """Intern the strings of value, a string, a list (returned as a tuple) or a dictionary."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(internValue(v) for v in value)
+    if isinstance(value, dict):
+        return {internValue(k): internValue(v) for k, v in value.items()}
+    return value
+
+
+class Record(Mapping):
+    """Compact replacement of the json dictionary of one collection entity.
+
+    The declared FIELDS are kept in __slots__ and left unset when the json
+    record does not have them, other keys go to a small dictionary. Values
+    of INTERNED fields have their strings interned and their lists stored
+    as tuples. A record reads like the dictionary it replaces:
+    record['name'], 'plot' in record, record.get('math', []), dict(record).
+    It is not read-only, item assignment sets a field (e.g. addRdf), but
+    collection accessors return lists rather than the stored tuples.
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    INTERNED = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.FIELDS)
+        cls._interned = frozenset(cls.INTERNED)
+
+    def __init__(self, record):
+        self._extra = None
+        for key, value in record.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, internValue(value) if key in self._interned else value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[sys.intern(key)] = value
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.toDict())
+
+    def toDict(self):
+        """Return the record as a json dictionary, tuples back as lists."""
+        return {key: toJson(value) for key, value in self.items()}
+
+
+def toJson(value):
+    """Return value with records as dictionaries and tuples as lists, for json and copies."""
+    if isinstance(value, Record):
+        return value.toDict()
+    if isinstance(value, tuple):
+        return [toJson(v) for v in value]
+    if isinstance(value, dict):
+        return {k: toJson(v) for k, v in value.items()}
+    return value
+
+
+class FrozenView(Mapping):
+    """Read-only view of a stored json dictionary, nested values included.
+
+    Nested dictionaries are returned as views too and lists as tuples, so
+    the data shared between threads cannot be changed through it. Values
+    are wrapped when accessed, the dictionary itself is not copied.
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return freeze(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._data)
+
+
+def freeze(value):
+    """Return value as a FrozenView, a tuple of frozen items, or itself for scalars."""
+    if isinstance(value, FrozenView):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenView(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+__decoder = JSONDecoder()
+
+
+def __skip(text, pos):
+    return WHITESPACE.match(text, pos).end()
+
+
+def __parseObject(text, pos, parseValue):
+    # parse the object starting at text[pos], parseValue(key, text, pos)
+    # returns each value and the position after it
+    if text[pos:pos+1] != '{':
+        raise JSONDecodeError('Expecting object', text, pos)
+    result = {}
+    pos = __skip(text, pos + 1)
+    if text[pos:pos+1] == '}':
+        return result, pos + 1
+    while True:
+        if text[pos:pos+1] != '"':
+            raise JSONDecodeError('Expecting property name enclosed in double quotes', text, pos)
+        key, pos = scanstring(text, pos + 1)
+        pos = __skip(text, pos)
+        if text[pos:pos+1] != ':':
+            raise JSONDecodeError("Expecting ':' delimiter", text, pos)
+        result[sys.intern(key)], pos = parseValue(key, text, __skip(text, pos + 1))
+        pos = __skip(text, pos)
+        if text[pos:pos+1] == '}':
+            return result, pos + 1
+        if text[pos:pos+1] != ',':
+            raise JSONDecodeError("Expecting ',' delimiter", text, pos)
+        pos = __skip(text, pos + 1)
+
+
+def loadJsonRecords(path, record):
+    """Load a collection json file with each entity of 'data' built as record.
+
+    Every entity is converted as soon as it is parsed, so the json
+    dictionaries of all entities never exist together. The text of the file
+    is read whole and kept while parsing, so peak memory is the file size
+    plus the records. Entity ids are interned, they are shared with other
+    collections and indexes. Returns {} if path does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fp:
+        text = fp.read()
+
+    def parseRecord(key, text, pos):
+        value, pos = __decoder.raw_decode(text, pos)
+        return record(value), pos
+
+    def parseTop(key, text, pos):
+        if key == 'data':
+            return __parseObject(text, pos, parseRecord)
+        return __decoder.raw_decode(text, pos)
+
+    dataDict, pos = __parseObject(text, __skip(text, 0), parseTop)
+    if __skip(text, pos) != len(text):
+        raise JSONDecodeError('Extra data', text, pos)
+    return dataDict
@@ -3,9 +3,12 @@ from ..general import MATH_FORMAT
 
 
 class Sedmls(PmrCollection):
+    INDEXES = {
+        'id2Url': lambda k, v: v['id'],
+    }
+
     def __init__(self, *paths):
         super().__init__(*paths)
-        self.id2Url = {v['id']: k for k, v in self.data.items()}
         self.statusC = {'deprecated': 0, 'current': 1,
                         'validating': 2, 'invalid': 3}
 
@@ -15,7 +18,8 @@ class Sedmls(PmrCollection):
     def getVariables(self, id, plot=None, collVariable=None, format=MATH_FORMAT.LATEX):
         url = self.getUrl(id)
         if plot == None:
-            return self.data[url]['variables']
+            # a copy, the stored dictionary is shared between threads
+            return dict(self.data[url]['variables'])
         else:
             series = self.data[url]['outputs'][plot]
             checkVars, variables = [], []
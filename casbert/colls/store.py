@@ -0,0 +1,170 @@
+from ..general import LruCache
+from collections.abc import Mapping
+import json
+import os
+import sqlite3
+import threading
+
+SOURCE_KEY = '_storeSource'
+
+# A collection store is an SQLite file converted from a listOf*.json file:
+# - meta(key, value)      : the other top level items of the json, as json,
+#                           and the fingerprint of the json file as SOURCE_KEY
+# - records(id, record)   : one json record per entity of 'data'
+# - index_<name>(key, id) : one table per declared PmrCollection index
+
+
+def fileFingerprint(path):
+    """Modification time and size of path, None if it does not exist.
+
+    Stores derived from a file keep its fingerprint, so a store built
+    before the file changed (e.g. by updateIndexes) is recognised as stale.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+class SqliteConnections:
+    """One connection to an SQLite file per thread, read-only unless readOnly is False."""
+
+    def __init__(self, path, readOnly=True):
+        self.path = path
+        self.readOnly = readOnly
+        self.__local = threading.local()
+
+    def get(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            if self.readOnly:
+                conn = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.__local.conn = conn
+        return conn
+
+
+def buildSqlite(path, write):
+    """Create the SQLite file path with write(conn), replacing an existing one atomically.
+
+    The file is written next to path and renamed when complete, so readers
+    never open a partial file.
+    """
+    tmpPath = path + '.tmp'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    conn = sqlite3.connect(tmpPath)
+    try:
+        write(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmpPath, path)
+    return path
+
+
+class SqliteMapping(Mapping):
+    """Read-only mapping over a two column SQLite table, opened per thread."""
+
+    def __init__(self, path, table, keyColumn, valueColumn, decode=None):
+        self.path = path
+        self.__connections = SqliteConnections(path)
+        self.__decode = decode
+        self.__getSql = 'SELECT %s FROM %s WHERE %s = ?' % (valueColumn, table, keyColumn)
+        self.__keysSql = 'SELECT %s FROM %s' % (keyColumn, table)
+        self.__itemsSql = 'SELECT %s, %s FROM %s' % (keyColumn, valueColumn, table)
+        self.__countSql = 'SELECT COUNT(*) FROM %s' % table
+
+    def _getConnection(self):
+        return self.__connections.get()
+
+    def _decode(self, value):
+        return self.__decode(value) if self.__decode is not None else value
+
+    def __getitem__(self, key):
+        row = self._getConnection().execute(self.__getSql, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._decode(row[0])
+
+    def __contains__(self, key):
+        return self._getConnection().execute(self.__getSql, (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self._getConnection().execute(self.__keysSql):
+            yield row[0]
+
+    def __len__(self):
+        return self._getConnection().execute(self.__countSql).fetchone()[0]
+
+    def items(self):
+        # one scan instead of a lookup per key
+        for key, value in self._getConnection().execute(self.__itemsSql):
+            yield key, self._decode(value)
+
+
+class RecordStore(SqliteMapping):
+    """The 'data' of a collection, records are decoded from json when accessed.
+
+    Recently used records are kept decoded in an LRU cache, so repeated
+    accessor calls for one hit decode it once.
+    """
+
+    def __init__(self, path, cacheSize=1024):
+        super().__init__(path, 'records', 'id', 'record', json.loads)
+        self.cache = LruCache(cacheSize)
+
+    def __getitem__(self, key):
+        record = self.cache.get(key)
+        if record is None:
+            record = SqliteMapping.__getitem__(self, key)
+            self.cache.put(key, record)
+        return record
+
+    def __contains__(self, key):
+        return self.cache.get(key) is not None or SqliteMapping.__contains__(self, key)
+
+    def getMeta(self):
+        return {key: json.loads(value) for key, value in
+                self._getConnection().execute('SELECT key, value FROM meta') if key != SOURCE_KEY}
+
+    def getSource(self):
+        """Fingerprint of the json file the store was converted from, None if unknown."""
+        row = self._getConnection().execute(
+            'SELECT value FROM meta WHERE key = ?', (SOURCE_KEY,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def getIndex(self, name):
+        """Return the stored index name, or None if the store does not have it."""
+        table = 'index_' + name
+        if self._getConnection().execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is None:
+            return None
+        return SqliteMapping(self.path, table, 'key', 'id')
+
+
+def getStorePath(jsonPath):
+    return os.path.splitext(jsonPath)[0] + '.sqlite'
+
+
+def convertToStore(dataDict, storePath, indexes=None, source=None):
+    """Write a collection json (dataDict) and its indexes ({name: {key: id}}) to storePath.
+
+    source ==> fileFingerprint of the json file, to recognise a store older than it
+    """
+    indexes = indexes if indexes is not None else {}
+
+    def write(conn):
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE records (id TEXT PRIMARY KEY, record TEXT) WITHOUT ROWID')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', ((k, json.dumps(v))
+                         for k, v in dataDict.items() if k != 'data'))
+        conn.execute('INSERT INTO meta VALUES (?, ?)', (SOURCE_KEY, json.dumps(source)))
+        conn.executemany('INSERT INTO records VALUES (?, ?)', ((k, json.dumps(v, separators=(',', ':')))
+                         for k, v in dataDict.get('data', {}).items()))
+        for name, index in indexes.items():
+            conn.execute('CREATE TABLE index_%s (key TEXT PRIMARY KEY, id TEXT) WITHOUT ROWID' % name)
+            conn.executemany('INSERT INTO index_%s VALUES (?, ?)' % name, index.items())
+
+    return buildSqlite(storePath, write)
@@ -1,14 +1,28 @@
 from .pmrcollection import PmrCollection
+from .record import Record
+
+
+class UnitRecord(Record):
+    FIELDS = ('text', 'names')
+    __slots__ = FIELDS
+    INTERNED = ('names',)
+
 
 class Units(PmrCollection):
+    RECORD = UnitRecord
+    INDEXES = {
+        'text2Id': lambda k, v: v['text'],
+        'name2Id': lambda k, v: v['names'],
+    }
+
     def __init__(self, *paths):
         super().__init__(*paths)
 
     def getID(self, text):
-        if text in self.getT2Id():
-            return self.getT2Id()[text]
-        else:
-            return None
+        return self.text2Id.get(text)
+
+    def getIdByName(self, name):
+        return self.name2Id.get(name)
 
     def getText(self, id):
         if id in self.data:
@@ -17,15 +31,17 @@ class Units(PmrCollection):
             return None;
 
     def getNames(self, id=None, text=None):
+        # records keep lists as tuples, callers get a list of their own
         if id in self.data:
-            return self.data[id]['names']
-        elif text in self.getT2Id():
-            return self.data[self.getT2Id()[text]]['names']
+            return list(self.data[id]['names'])
+        elif text in self.text2Id:
+            return list(self.data[self.text2Id[text]]['names'])
         else:
             return []
 
+    # the returned dictionaries are the shared indexes, do not modify them
     def getId2T(self):
-        return {v['text']:k for k,v in self.data.items()}
+        return self.text2Id
 
     def getT2Id(self):
-        return {v['text']:k for k,v in self.data.items()}
+        return self.text2Id
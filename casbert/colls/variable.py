@@ -1,18 +1,145 @@
 from .pmrcollection import PmrCollection
-from ..general import MATH_FORMAT
+from .record import Record
+from ..general import MATH_FORMAT, LruCache
 import math
+import numpy as np
+
+
+class VariableRecord(Record):
+    FIELDS = ('name', 'shortName', 'type', 'init', 'rate', 'unit', 'component', 'math', 'plot',
+              'dependent')
+    __slots__ = FIELDS
+    INTERNED = ('name', 'shortName', 'type', 'unit', 'component', 'math', 'plot', 'dependent')
+
+
+class VariableColumns:
+    """Scalar fields of variables as numpy arrays, row i describing ids[i].
+
+    type, unit and component are integer codes into the types, units and
+    components dictionaries (value -> code), -1 when a variable misses the
+    field; init and rate are floats, nan when unknown. Built with the row
+    order of an index, mask returns boolean arrays usable on its score rows.
+    With the Units and Components collections, units can also be filtered
+    by name or text and components by name.
+    """
+
+    def __init__(self, variables, ids, units=None, components=None):
+        self.ids = ids
+        self.types, self.units, self.components = {}, {}, {}
+        numRows = len(ids)
+        self.type = np.full(numRows, -1, dtype=np.int16)
+        self.unit = np.full(numRows, -1, dtype=np.int32)
+        self.component = np.full(numRows, -1, dtype=np.int32)
+        self.init = np.full(numRows, np.nan, dtype=np.float64)
+        self.rate = np.full(numRows, np.nan, dtype=np.float64)
+        for row, id in enumerate(ids):
+            record = variables.data.get(id)
+            if record is None:
+                continue
+            self.type[row] = self.__getCode(self.types, record.get('type'))
+            self.unit[row] = self.__getCode(self.units, record.get('unit'))
+            self.component[row] = self.__getCode(self.components, record.get('component'))
+            self.init[row] = self.__getFloat(record.get('init'))
+            self.rate[row] = self.__getFloat(record.get('rate'))
+        self.__units = units
+        self.__components = components
+        # component name -> codes of the components having it, names are not unique
+        self.componentNames = {}
+        if components is not None:
+            for compId, code in self.components.items():
+                if compId in components.data:
+                    self.componentNames.setdefault(components.getName(compId), []).append(code)
+
+    def __getCode(self, codes, value):
+        if value is None:
+            return -1
+        return codes.setdefault(value, len(codes))
+
+    def __getFloat(self, value):
+        return float(value) if isinstance(value, (int, float)) else np.nan
+
+    def __getTypeCodes(self, value):
+        if value in self.types:
+            return [self.types[value]]
+        raise ValueError('Unknown variable type %r, expected one of %s' % (value, sorted(self.types)))
+
+    def __getUnitCodes(self, value):
+        # a unit id, or a unit name or text resolved with the Units collection
+        if value in self.units:
+            return [self.units[value]]
+        if self.__units is not None:
+            unitId = self.__units.getIdByName(value) or self.__units.getID(value)
+            if unitId is not None:
+                return [self.units[unitId]] if unitId in self.units else []
+            if value in self.__units.data:
+                return []
+        raise ValueError('Unknown unit %r, expected a unit id, name or text' % (value,))
+
+    def __getComponentCodes(self, value):
+        # a component id, or the name of one or more components
+        if value in self.components:
+            return [self.components[value]]
+        if value in self.componentNames:
+            return self.componentNames[value]
+        if self.__components is not None and value in self.__components.data:
+            return []
+        raise ValueError('Unknown component %r, expected a component id or name' % (value,))
+
+    def __isIn(self, column, getCodes, values):
+        values = [values] if isinstance(values, str) else values
+        return np.isin(column, [code for value in values for code in getCodes(value)])
+
+    def __inRange(self, column, bounds):
+        low, high = bounds
+        mask = ~np.isnan(column)
+        if low is not None:
+            mask &= column >= low
+        if high is not None:
+            mask &= column <= high
+        return mask
+
+    def mask(self, type=None, unit=None, component=None, init=None, rate=None):
+        """Return the boolean mask of the rows matching every given filter.
+
+        type, unit, component ==> a value or a list of accepted values,
+                                  e.g. type='state', unit=['second', 'millisecond'];
+                                  units by id, name or text, components by id or name
+        init, rate ==> (low, high) inclusive range, None for an open bound
+        Raises ValueError for a value that is not a known type, unit or component.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        for column, getCodes, values in [(self.type, self.__getTypeCodes, type),
+                                         (self.unit, self.__getUnitCodes, unit),
+                                         (self.component, self.__getComponentCodes, component)]:
+            if values is not None:
+                mask &= self.__isIn(column, getCodes, values)
+        for column, bounds in [(self.init, init), (self.rate, rate)]:
+            if bounds is not None:
+                mask &= self.__inRange(column, bounds)
+        return mask
 
 
 class Variables(PmrCollection):
-    def __init__(self, sysMaths, *paths):
+    RECORD = VariableRecord
+
+    def __init__(self, sysMaths, *paths, closureCacheSize=4096):
         super().__init__(*paths)
         self.sysMaths = sysMaths
+        self.__adjacency = None
+        self.closureCache = LruCache(closureCacheSize)
 
     def getT2Id(self, ids=None, short=False):
         if ids != None:
             return {self.getName(id, short): id for id in ids if self.getType(id) != 'rate'}
         return {self.getName(id, short): id for id in self.data if self.getType(id) != 'rate'}
 
+    def getColumns(self, ids, units=None, components=None):
+        """Return the VariableColumns of ids, e.g. the entity ids of the variable index.
+
+        units, components ==> the Units and Components collections, to filter by names
+        """
+        return VariableColumns(self, ids, units, components)
+
     def getName(self, id, short=False):
         if short:
             return(self.data[id]['shortName'])
@@ -39,23 +166,69 @@ class Variables(PmrCollection):
                 varMaths += [self.sysMaths.getText(mathId, format)]
         return varMaths
 
-    def getDependents(self, id, format=MATH_FORMAT.WEB, varDep={}):
-        if 'dependent' in self.data[id]:
-            if len(self.data[id]['dependent']) > 0:
-                for varIdDep, varNameDep in self.data[id]['dependent'].items():
-                    if varIdDep not in varDep:
-                        varDep[varIdDep] = {'name': varNameDep, 'math': self.getMaths(
-                            varIdDep, format), 'type': self.getType(varIdDep), 'init': self.getInit(varIdDep)}
-                        if 'dependent' in self.data[varIdDep]:
-                            if len(self.data[varIdDep]['dependent']) > 0:
-                                self.getDependents(varIdDep, format, varDep)
+    def __getAdjacency(self):
+        # id -> ((dependent id, dependent name), ...), built once
+        if self.__adjacency is None:
+            self.__adjacency = {id: tuple(v['dependent'].items())
+                                for id, v in self.data.items() if len(v.get('dependent', {})) > 0}
+        return self.__adjacency
+
+    def warmup(self):
+        """Build the dependency adjacency now rather than on the first getDependents."""
+        self.__getAdjacency()
+        return self
+
+    def getDependentClosure(self, id):
+        """Return the transitive dependents of id as a tuple of (id, name, depth).
+
+        The graph is walked breadth first without recursion, so each
+        dependent comes with its shortest depth. Closures are cached per
+        variable.
+        """
+        closure = self.closureCache.get(id)
+        if closure is None:
+            adjacency = self.__getAdjacency()
+            closure, visited = [], set()
+            frontier, depth = [id], 1
+            while len(frontier) > 0:
+                nextFrontier = []
+                for varId in frontier:
+                    for varIdDep, varNameDep in adjacency.get(varId, ()):
+                        if varIdDep not in visited:
+                            visited.add(varIdDep)
+                            closure += [(varIdDep, varNameDep, depth)]
+                            nextFrontier += [varIdDep]
+                frontier, depth = nextFrontier, depth + 1
+            closure = tuple(closure)
+            self.closureCache.put(id, closure)
+        return closure
+
+    def getDependents(self, id, format=MATH_FORMAT.WEB, varDep=None, maxDepth=None, maxSize=None):
+        """Get the transitive dependents of variable id with their maths.
+
+        maxDepth ==> only dependents up to this many hops away
+        maxSize ==> at most this many dependents, the closest first
+        varDep ==> optional dictionary filled with the dependents
+        Maths are only rendered for the returned dependents.
+        """
+        varDep = {} if varDep is None else varDep
+        for varIdDep, varNameDep, depth in self.getDependentClosure(id):
+            if maxDepth is not None and depth > maxDepth:
+                break
+            if maxSize is not None and len(varDep) >= maxSize:
+                break
+            if varIdDep not in varDep:
+                varDep[varIdDep] = {'name': varNameDep, 'math': self.getMaths(
+                    varIdDep, format), 'type': self.getType(varIdDep), 'init': self.getInit(varIdDep)}
+        return varDep
 
     def getUnit(self, id):
         return self.data[id]['unit']
 
     def getPlots(self, id):
+        # records keep lists as tuples, callers get a list of their own
         if 'plot' in self.data[id]:
-            return self.data[id]['plot']
+            return list(self.data[id]['plot'])
         return []
 
     def getCompId(self, id):
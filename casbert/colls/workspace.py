@@ -4,6 +4,10 @@ import os
 
 
 class Workspaces(PmrCollection):
+    INDEXES = {
+        'id2Url': lambda k, v: v['id'],
+    }
+
     def __init__(self, *paths):
         super().__init__(*paths)
         self.allWksDir = os.path.join(CURRENT_PATH, WORKSPACE_DIR)
@@ -21,9 +25,10 @@ class Workspaces(PmrCollection):
     def getCellml(self, id=None, url=None):
         if id != None:
             url = self.getUrl(id)
+        # copies, the stored values are shared between threads
         if url in self.data:
             if 'cellml' in self.data[url]:
-                return self.data[url]['cellml']
+                return list(self.data[url]['cellml'])
         return []
 
     def getUrl(self, id):
@@ -36,5 +41,5 @@ class Workspaces(PmrCollection):
             url = self.getUrl(id)
         if url in self.data:
             if 'exposures' in self.data[url]:
-                return self.data[url]['exposures']
+                return dict(self.data[url]['exposures'])
         return {}
@@ -1,7 +1,8 @@
 import json
 import os
-import requests
+import threading
 import pickle
+from collections import OrderedDict
 import gzip
 import io
 from lxml import etree
@@ -35,6 +36,8 @@ RS_C2P_XSL = 'ctopff.xsl'
 RS_M2L_XSL = 'mmltex.xsl'
 RS_CLUSTERER = 'cellmlClusterer.json'
 RS_ONTOLOGY = 'ontoDf.gz'
+RS_RESULT_CARDS = 'variableCards.sqlite'
+RS_MATH_RENDER = 'mathRender.sqlite'
 
 IMG_EXT = '.png'
 
@@ -55,6 +58,56 @@ class MATH_FORMAT(Enum):
     LATEX = 3
 
 
+class LruCache:
+    """Bounded, thread-safe LRU cache with hit/miss counters."""
+
+    def __init__(self, maxSize=1024):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            if key in self.__data:
+                self.__data.move_to_end(key)
+                self.hits += 1
+                return self.__data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxSize <= 0:
+            return
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxSize:
+                self.__data.popitem(last=False)
+
+    def resize(self, maxSize):
+        with self.__lock:
+            self.maxSize = maxSize
+            while len(self.__data) > max(maxSize, 0):
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _afterFork(self):
+        # a thread of the parent may have held the lock when it forked
+        self.__lock = threading.Lock()
+
+    def stats(self):
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.__data), 'maxSize': self.maxSize}
+
+
 def loadJson(*paths):
     file = os.path.join(CURRENT_PATH, *paths)
     isExist = os.path.exists(file)
@@ -144,6 +197,7 @@ def getAllFilesInDir(*paths):
 
 
 def getUrlFromPmr(url):
+    import requests
     r = requests.get(
         url, headers={"Accept": "application/vnd.physiome.pmr2.json.1"})
     urls = [link['href'] for link in r.json()['collection']['links']]
@@ -153,6 +207,7 @@ def getUrlFromPmr(url):
 
 
 def getJsonFromPmr(url):
+    import requests
     r = requests.get(
         url, headers={"Accept": "application/vnd.physiome.pmr2.json.1"})
     try:
@@ -213,11 +268,16 @@ greek_code2name = {
 }
 
 greek_name2code = {v: k for k, v in greek_code2name.items()}
+# XSLT transformers are compiled on first use by __loadData
 tran_c2p = None
 tran_m2l = None
+__dataLock = threading.Lock()
+__isDataExtracted = False
 
 
 def m_c2p(math_c, format=MATH_FORMAT.WEB):
+    if tran_c2p is None:
+        __loadData()
     preff = '{http://www.w3.org/1998/Math/MathML}'
     if '<math ' not in math_c:
         math_c = '<math xmlns="http://www.w3.org/1998/Math/MathML">' + math_c + '</math>'
@@ -264,6 +324,8 @@ def m_c2p(math_c, format=MATH_FORMAT.WEB):
 
 def mml2tex(text):
     """ Remove TeX codes in text"""
+    if tran_m2l is None:
+        __loadData()
     text = re.sub(r"(\$\$.*?\$\$)", " ", text)
 
     """ Find MathML codes and replace it with its LaTeX representations."""
@@ -285,6 +347,7 @@ def mml2tex(text):
 
 def updateIndexes(filePath=''):
     import zipfile
+    import requests
     path = os.path.dirname(os.path.realpath(__file__))
     if not os.path.exists(filePath):
         print("... downloading from server")
@@ -312,10 +375,24 @@ def __extractData():
         updateIndexes(os.path.join(drive, 'casbert_data.zip'))
 
 
+def ensureData():
+    """Extract the resource data on first use instead of at import time."""
+    global __isDataExtracted
+    if __isDataExtracted:
+        return
+    with __dataLock:
+        if not __isDataExtracted:
+            __extractData()
+            __isDataExtracted = True
+
+
 def __loadData():
-    xsl_c2p = etree.parse(os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_C2P_XSL))
-    global tran_c2p
-    tran_c2p = etree.XSLT(xsl_c2p)
-    xsl_m2l = etree.parse(os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_M2L_XSL))
-    global tran_m2l
-    tran_m2l = etree.XSLT(xsl_m2l)
+    ensureData()
+    with __dataLock:
+        global tran_c2p, tran_m2l
+        if tran_c2p is None:
+            xsl_c2p = etree.parse(os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_C2P_XSL))
+            tran_c2p = etree.XSLT(xsl_c2p)
+        if tran_m2l is None:
+            xsl_m2l = etree.parse(os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_M2L_XSL))
+            tran_m2l = etree.XSLT(xsl_m2l)
@@ -0,0 +1,94 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from .searcher import Searcher
+
+
+class AsyncSearcher:
+    """asyncio facade of a Searcher, for async web servers.
+
+    Encoding, scoring and metadata expansion run on a bounded thread pool,
+    so they do not block the event loop. Queries of concurrent requests
+    are encoded together by the EncodeScheduler of the model, started with
+    maxWait and maxBatchSize if the Searcher has none. The embeddings go to
+    the shared query cache, where the search methods find them.
+
+    Every search method takes a timeout in seconds (default: the one given
+    here, None waits forever) and raises asyncio.TimeoutError when it is
+    exceeded. A cancelled or timed out request gives up its place in the
+    queue; work already running in a thread finishes and is discarded.
+    """
+
+    def __init__(self, searcher=None, maxWorkers=4, maxPending=64, maxWait=0.003, maxBatchSize=32,
+                 timeout=None, **searcherParams):
+        """
+        searcher ==> the Searcher to wrap, None creates one with searcherParams
+        maxWorkers ==> threads running searches
+        maxPending ==> requests searching at once, the others wait for a slot
+        maxWait, maxBatchSize ==> encode window if a scheduler is started, see EncodeScheduler
+        timeout ==> default timeout of a request in seconds
+        """
+        self.searcher = searcher if searcher is not None else Searcher(**searcherParams)
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='casbert-async')
+        self.scheduler = self.searcher.getEncodeScheduler()
+        if self.scheduler is None:
+            self.scheduler = self.searcher.startEncodeScheduler(maxWait, maxBatchSize)
+        self.timeout = timeout
+        self.__maxPending = maxPending
+        self.__slots = None
+
+    async def encode(self, query):
+        """Return the embedding of query, encoded in one batch with concurrent queries."""
+        return await asyncio.wrap_future(self.scheduler.submit(query))
+
+    async def __run(self, methodName, query, args, kwargs, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(self.__search(methodName, query, args, kwargs), timeout)
+
+    async def __search(self, methodName, query, args, kwargs):
+        if self.__slots is None:
+            # created here so it belongs to the running loop
+            self.__slots = asyncio.Semaphore(self.__maxPending)
+        async with self.__slots:
+            # without a query cache the search would encode again
+            if self.searcher.algorithm in [Searcher.ALG_CASBERT, Searcher.ALG_HYBRID] and \
+                    self.searcher.queryCache.maxSize > 0:
+                await self.encode(query)
+            method = getattr(self.searcher, methodName)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(method, query, *args, **kwargs))
+
+    async def search(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('search', query, args, kwargs, timeout)
+
+    async def searchVariables(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchVariables', query, args, kwargs, timeout)
+
+    async def searchCellmls(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchCellmls', query, args, kwargs, timeout)
+
+    async def searchSedmls(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchSedmls', query, args, kwargs, timeout)
+
+    async def searchImages(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchImages', query, args, kwargs, timeout)
+
+    async def searchComponents(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchComponents', query, args, kwargs, timeout)
+
+    async def searchPlots(self, query, *args, timeout=None, **kwargs):
+        return await self.__run('searchPlots', query, args, kwargs, timeout)
+
+    async def warmup(self, types=None):
+        """Load indexes and collections in a thread, see Searcher.warmup."""
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.searcher.warmup, types)
+        return self
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
@@ -0,0 +1,192 @@
+import math
+import os
+import torch
+
+PRECISION_FLOAT32 = 'float32'
+PRECISION_FLOAT16 = 'float16'
+PRECISION_INT8 = 'int8'
+
+
+class IndexBackend:
+    """Nearest neighbour search over one embedding matrix of a PmrIndex.
+
+    The matrix is L2-normalised once when the backend is built, so cosine
+    similarity is a plain dot product. It can be kept as float32, float16
+    or int8 with one scale per row, to reduce memory and bandwidth.
+
+    search receives a (numQueries, dim) tensor and returns two lists of
+    lists, the scores and the row numbers of the best topK rows for each
+    query, in descending order of score. An optional boolean rowMask of
+    numRows excludes rows before the top rows are selected.
+    """
+
+    def __init__(self, embedding, precision=PRECISION_FLOAT32, normalised=False):
+        self.precision = precision
+        # an already normalised float32 matrix (e.g. mmap backed) is used without copying
+        if not normalised:
+            normalised = torch.nn.functional.normalize(embedding.float(), p=2, dim=1)
+        else:
+            normalised = embedding.float()
+        self._scale = None
+        if precision == PRECISION_FLOAT32:
+            self._matrix = normalised
+        elif precision == PRECISION_FLOAT16:
+            self._matrix = normalised.half()
+        elif precision == PRECISION_INT8:
+            self._scale = normalised.abs().max(dim=1)[0].clamp(min=1e-12) / 127
+            self._matrix = torch.round(normalised / self._scale.unsqueeze(1)).to(torch.int8)
+        else:
+            raise ValueError('Unknown precision: %s' % precision)
+
+    @property
+    def numRows(self):
+        return self._matrix.shape[0]
+
+    def normaliseQueries(self, queryEmbeddings):
+        return torch.nn.functional.normalize(queryEmbeddings.float(), p=2, dim=1)
+
+    def score(self, queries, rows=None, chunk=16384):
+        """Return (numQueries, numRows) scores of normalised queries.
+
+        rows restricts scoring to the given row numbers. Reduced precision
+        matrices are widened to float32 chunk by chunk.
+        """
+        matrix = self._matrix if rows is None else self._matrix[rows]
+        scale = None
+        if self._scale is not None:
+            scale = self._scale if rows is None else self._scale[rows]
+        if self.precision == PRECISION_FLOAT32:
+            return queries @ matrix.T
+        scores = []
+        for start in range(0, matrix.shape[0], chunk):
+            part = queries @ matrix[start:start+chunk].float().T
+            if scale is not None:
+                part *= scale[start:start+chunk]
+            scores += [part]
+        if len(scores) == 0:
+            return queries.new_zeros((queries.shape[0], 0))
+        return torch.cat(scores, dim=1)
+
+    def search(self, queryEmbeddings, topK, rowMask=None):
+        raise NotImplementedError
+
+    def scoreRows(self, queryEmbeddings, rows):
+        """Return (numQueries, len(rows)) exact cosine similarities for the given rows."""
+        return self.score(self.normaliseQueries(queryEmbeddings), rows=rows)
+
+
+class BruteForceBackend(IndexBackend):
+    """Exact cosine similarity scan over every row."""
+
+    def search(self, queryEmbeddings, topK, rowMask=None):
+        scores = self.score(self.normaliseQueries(queryEmbeddings))
+        k = min(topK, scores.shape[1])
+        if rowMask is not None:
+            scores.masked_fill_(~rowMask, float('-inf'))
+            k = min(k, int(rowMask.sum()))
+        topResults = torch.topk(scores, k=k, dim=1)
+        return topResults[0].tolist(), topResults[1].tolist()
+
+
+class IvfBackend(IndexBackend):
+    """Approximate search with an inverted file (IVF) index.
+
+    Rows are clustered with spherical k-means into nlist lists. A query is
+    only scored against the rows of its nprobe closest lists, so nprobe
+    trades recall (higher) against latency (lower). The clustering is
+    built on CPU from the embedding matrix and saved to path, so it is
+    trained once per index file.
+    """
+
+    def __init__(self, embedding, nlist=None, nprobe=8, niter=20, path=None, seed=0,
+                 precision=PRECISION_FLOAT32, normalised=False):
+        super().__init__(embedding, precision, normalised)
+        numRows = self.numRows
+        self.nlist = min(nlist if nlist is not None else max(1, int(4 * math.sqrt(numRows))), numRows)
+        self.nprobe = nprobe
+
+        # training works on the float32 normalised rows, whatever the precision
+        if self.precision == PRECISION_FLOAT32:
+            normalised = self._matrix
+        elif normalised:
+            normalised = embedding.float()
+        else:
+            normalised = torch.nn.functional.normalize(embedding.float(), p=2, dim=1)
+        # a saved index is reused only if it was built from the same matrix
+        checksum = float(normalised.sum())
+        ivf = None
+        if path is not None and os.path.exists(path):
+            ivf = torch.load(path, map_location=torch.device('cpu'))
+            if ivf['rows'] != numRows or ivf['nlist'] != self.nlist or \
+                    not math.isclose(ivf['checksum'], checksum, rel_tol=1e-6, abs_tol=1e-3):
+                ivf = None
+        if ivf is None:
+            centroids, assign = self.__train(normalised, niter, seed)
+            ivf = {'rows': numRows, 'nlist': self.nlist, 'checksum': checksum,
+                   'centroids': centroids, 'assign': assign}
+            if path is not None:
+                torch.save(ivf, path)
+
+        self._centroids = ivf['centroids']
+        # rows grouped by list, list i is order[offsets[i]:offsets[i+1]]
+        self._order = torch.argsort(ivf['assign'])
+        counts = torch.bincount(ivf['assign'], minlength=self.nlist)
+        self._offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(counts, 0)]).tolist()
+
+    def __assign(self, normalised, centroids, chunk=8192):
+        assign = []
+        for start in range(0, normalised.shape[0], chunk):
+            scores = normalised[start:start+chunk] @ centroids.T
+            assign += [torch.argmax(scores, dim=1)]
+        return torch.cat(assign)
+
+    def __train(self, normalised, niter, seed):
+        generator = torch.Generator().manual_seed(seed)
+        init = torch.randperm(normalised.shape[0], generator=generator)[:self.nlist]
+        centroids = normalised[init].clone()
+        for _ in range(niter):
+            assign = self.__assign(normalised, centroids)
+            sums = torch.zeros_like(centroids).index_add_(0, assign, normalised)
+            counts = torch.bincount(assign, minlength=self.nlist)
+            # empty lists keep their previous centroid
+            nonEmpty = counts > 0
+            centroids[nonEmpty] = torch.nn.functional.normalize(sums[nonEmpty], p=2, dim=1)
+        return centroids, self.__assign(normalised, centroids)
+
+    def search(self, queryEmbeddings, topK, rowMask=None):
+        # with a rowMask only the allowed rows of the probed lists are scored;
+        # when fewer than topK of them are allowed, e.g. with a selective filter,
+        # every allowed row is scored instead, so the results are not cut short
+        queries = self.normaliseQueries(queryEmbeddings)
+        probes = torch.topk(queries @ self._centroids.T,
+                            k=min(self.nprobe, self.nlist), dim=1)[1].tolist()
+        allowed = rowMask.nonzero().flatten() if rowMask is not None else None
+        allScores, allIdxs = [], []
+        for query, probe in zip(queries, probes):
+            candidates = torch.cat([self._order[self._offsets[c]:self._offsets[c+1]] for c in probe])
+            if rowMask is not None:
+                candidates = candidates[rowMask[candidates]]
+                if candidates.shape[0] < topK:
+                    candidates = allowed
+            scores = self.score(query.unsqueeze(0), rows=candidates)[0]
+            topResults = torch.topk(scores, k=min(topK, scores.shape[0]))
+            allScores += [topResults[0].tolist()]
+            allIdxs += [candidates[topResults[1]].tolist()]
+        return allScores, allIdxs
+
+
+BACKEND_EXACT = 'exact'
+BACKEND_IVF = 'ivf'
+
+BACKENDS = {
+    BACKEND_EXACT: BruteForceBackend,
+    BACKEND_IVF: IvfBackend,
+}
+
+
+def createBackend(backend, embedding, path=None, **params):
+    """Build the backend named backend (or given as an IndexBackend subclass)."""
+    cls = BACKENDS[backend] if isinstance(backend, str) else backend
+    if issubclass(cls, IvfBackend):
+        return cls(embedding, path=path, **params)
+    return cls(embedding, **params)
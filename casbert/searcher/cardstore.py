@@ -0,0 +1,61 @@
+from ..colls.store import SqliteConnections, buildSqlite
+import json
+
+CARD_STORE_VERSION = 1
+
+
+class ResultCardStore:
+    """Read-only keyed store of precomputed result cards in an SQLite file.
+
+    A card is the JSON of the metadata returned for one entity, so a search
+    answers with one lookup per hit. Each thread gets its own connection.
+    fingerprint is the one given to build, identifying the data the cards
+    were computed from, or None.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__connections = SqliteConnections(path)
+        meta = dict(self.__getConnection().execute('SELECT key, value FROM meta').fetchall())
+        if int(meta.get('version', 0)) != CARD_STORE_VERSION:
+            raise ValueError('Unsupported result card store version: %s' % meta.get('version'))
+        self.fingerprint = json.loads(meta.get('fingerprint', 'null'))
+
+    def __getConnection(self):
+        return self.__connections.get()
+
+    def get(self, id):
+        row = self.__getConnection().execute(
+            'SELECT card FROM cards WHERE id = ?', (id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def getMany(self, ids):
+        """Return the cards of ids in the same order, None for missing ids."""
+        cards = {}
+        ids = list(ids)
+        # stay below the SQLite host parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start+500]
+            rows = self.__getConnection().execute(
+                'SELECT id, card FROM cards WHERE id IN (%s)' % ','.join('?' * len(chunk)), chunk)
+            cards.update({id: card for id, card in rows})
+        return [json.loads(cards[id]) if id in cards else None for id in ids]
+
+    def __len__(self):
+        return self.__getConnection().execute('SELECT COUNT(*) FROM cards').fetchone()[0]
+
+    @staticmethod
+    def build(path, items, fingerprint=None):
+        """Write (id, card) items to a new store at path, replacing it atomically.
+
+        fingerprint ==> json value identifying the data the cards are computed from
+        """
+        def write(conn):
+            conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('CREATE TABLE cards (id TEXT PRIMARY KEY, card TEXT) WITHOUT ROWID')
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('version', str(CARD_STORE_VERSION)))
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('fingerprint', json.dumps(fingerprint)))
+            conn.executemany('INSERT OR REPLACE INTO cards VALUES (?, ?)',
+                             ((id, json.dumps(card, separators=(',', ':'))) for id, card in items))
+
+        return ResultCardStore(buildSqlite(path, write))
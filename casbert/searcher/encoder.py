@@ -0,0 +1,253 @@
+from collections import Counter
+from concurrent.futures import Future
+import os
+import threading
+import time
+import torch
+from sentence_transformers import SentenceTransformer
+from ..general import LruCache
+
+BERT_MODEL = 'multi-qa-MiniLM-L6-cos-v1'
+
+# models whose tokenizer lowercases the text, so the case of a query does not
+# change its embedding; add the name of other uncased models
+UNCASED_MODELS = {BERT_MODEL}
+
+# one SentenceTransformer instance per model name, shared by every PmrIndex
+__encoders = {}
+__encoderLock = threading.Lock()
+
+
+def getEncoder(modelName=BERT_MODEL):
+    """Return the shared SentenceTransformer for modelName, loading it once."""
+    encoder = __encoders.get(modelName)
+    if encoder is None:
+        with __encoderLock:
+            encoder = __encoders.get(modelName)
+            if encoder is None:
+                encoder = SentenceTransformer(modelName)
+                __encoders[modelName] = encoder
+    return encoder
+
+
+def registerEncoder(modelName, encoder):
+    """Register an already loaded encoder so that getEncoder returns it."""
+    with __encoderLock:
+        __encoders[modelName] = encoder
+
+
+def clearEncoders():
+    with __encoderLock:
+        __encoders.clear()
+
+
+def normaliseQuery(query, modelName=BERT_MODEL):
+    # extra spaces never change the embedding, case only for cased models
+    query = ' '.join(query.split())
+    return query.lower() if modelName in UNCASED_MODELS else query
+
+
+class QueryCache(LruCache):
+    """Bounded, thread-safe LRU cache of query embeddings.
+
+    Keys are (model name, normalised query), so a query sent to several
+    entity types, or by several users, is encoded once. Queries differing
+    in case share a key only for UNCASED_MODELS.
+    """
+
+    def get(self, modelName, query):
+        return LruCache.get(self, (modelName, normaliseQuery(query, modelName)))
+
+    def put(self, modelName, query, embedding):
+        LruCache.put(self, (modelName, normaliseQuery(query, modelName)), embedding)
+
+    def encode(self, model, modelName, query):
+        """Return the embedding of query, encoding it with model on a miss."""
+        embedding = self.get(modelName, query)
+        if embedding is None:
+            embedding = model.encode(query, convert_to_tensor=True)
+            self.put(modelName, query, embedding)
+        return embedding
+
+    def encodeBatch(self, model, modelName, queries):
+        """Return a (len(queries), dim) tensor, encoding all misses in one call."""
+        embeddings = [self.get(modelName, query) for query in queries]
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if len(missing) > 0:
+            encoded = model.encode([queries[i] for i in missing], convert_to_tensor=True)
+            for i, embedding in zip(missing, encoded):
+                # clone so a cached row does not keep the whole batch alive
+                embedding = embedding.clone()
+                embeddings[i] = embedding
+                self.put(modelName, queries[i], embedding)
+        return torch.stack(embeddings)
+
+
+# shared by every PmrIndex that is not given its own cache
+__queryCache = QueryCache()
+
+
+def getQueryCache():
+    return __queryCache
+
+
+class EncodeScheduler:
+    """Encodes the queries of concurrent callers together in micro-batches.
+
+    A worker thread takes the first queued query, waits up to maxWait
+    seconds or until maxBatchSize queries are queued, and encodes them in
+    one forward pass. Queries found in the query cache do not wait. A
+    longer window gives bigger batches, so more throughput, at the cost of
+    tail latency; stats returns the queue depth and batch size histograms
+    to tune it.
+    """
+
+    def __init__(self, modelName=BERT_MODEL, model=None, queryCache=None, maxWait=0.003, maxBatchSize=32):
+        self.modelName = modelName
+        self.maxWait = maxWait
+        self.maxBatchSize = maxBatchSize
+        self.__model = model
+        self.__queryCache = queryCache if queryCache is not None else getQueryCache()
+        self.__batchSizes = Counter()
+        self.__queueDepths = Counter()
+        self.__isClosed = False
+        self.__resetWorker()
+
+    def __resetWorker(self):
+        # also called in a forked child, where the parent's thread does not exist
+        self.__condition = threading.Condition()
+        self.__queue = []
+        self.__thread = None
+
+    def submit(self, query):
+        """Queue query, return a concurrent.futures.Future of its embedding."""
+        future = Future()
+        embedding = self.__queryCache.get(self.modelName, query)
+        if embedding is not None:
+            future.set_result(embedding)
+            return future
+        with self.__condition:
+            if self.__isClosed:
+                raise RuntimeError('EncodeScheduler is closed')
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='casbert-encode', daemon=True)
+                self.__thread.start()
+            self.__queue += [(query, future)]
+            self.__queueDepths[len(self.__queue)] += 1
+            self.__condition.notify()
+        return future
+
+    def encode(self, query, timeout=None):
+        return self.submit(query).result(timeout)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while len(self.__queue) == 0 and not self.__isClosed:
+                    self.__condition.wait()
+                if len(self.__queue) == 0:
+                    return
+                deadline = time.monotonic() + self.maxWait
+                while len(self.__queue) < self.maxBatchSize:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                batch = self.__queue[:self.maxBatchSize]
+                del self.__queue[:self.maxBatchSize]
+                # callers that cancelled are dropped
+                batch = [(query, future) for query, future in batch if future.set_running_or_notify_cancel()]
+                if len(batch) > 0:
+                    self.__batchSizes[len(batch)] += 1
+            if len(batch) == 0:
+                continue
+            try:
+                embeddings = self.__encode([query for query, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def __encode(self, queries):
+        # queries with the same cache key are encoded once, as the first caller wrote it
+        keys = [normaliseQuery(query, self.modelName) for query in queries]
+        unique = {}
+        for key, query in zip(keys, queries):
+            unique.setdefault(key, query)
+        model = self.__model if self.__model is not None else getEncoder(self.modelName)
+        embeddings = {}
+        for (key, query), embedding in zip(unique.items(),
+                                           model.encode(list(unique.values()), convert_to_tensor=True)):
+            # clone so a cached row does not keep the whole batch alive
+            embeddings[key] = embedding.clone()
+            self.__queryCache.put(self.modelName, query, embeddings[key])
+        return [embeddings[key] for key in keys]
+
+    def stats(self):
+        """Current queue depth, batch and query counts and the histograms.
+
+        batchSizes ==> {batch size: number of batches}
+        queueDepths ==> {queue depth seen by a new query, itself included: number of queries}
+        """
+        with self.__condition:
+            return {'queueDepth': len(self.__queue),
+                    'batches': sum(self.__batchSizes.values()),
+                    'queries': sum(size * count for size, count in self.__batchSizes.items()),
+                    'batchSizes': dict(sorted(self.__batchSizes.items())),
+                    'queueDepths': dict(sorted(self.__queueDepths.items())),
+                    'maxWait': self.maxWait, 'maxBatchSize': self.maxBatchSize}
+
+    def resetStats(self):
+        with self.__condition:
+            self.__batchSizes.clear()
+            self.__queueDepths.clear()
+
+    def close(self):
+        """Stop the worker once the queued queries are encoded."""
+        with self.__condition:
+            self.__isClosed = True
+            self.__condition.notify_all()
+
+    def _afterFork(self):
+        self.__resetWorker()
+
+
+# at most one scheduler per model name, used by PmrIndex.encodeQuery when set
+__schedulers = {}
+
+
+def startEncodeScheduler(modelName=BERT_MODEL, model=None, maxWait=0.003, maxBatchSize=32):
+    """Micro-batch the query encodes of modelName, returns its EncodeScheduler.
+
+    An already started scheduler gets the new window.
+    """
+    with __encoderLock:
+        scheduler = __schedulers.get(modelName)
+        if scheduler is None:
+            scheduler = EncodeScheduler(modelName, model, maxWait=maxWait, maxBatchSize=maxBatchSize)
+            __schedulers[modelName] = scheduler
+        else:
+            scheduler.maxWait, scheduler.maxBatchSize = maxWait, maxBatchSize
+    return scheduler
+
+
+def getEncodeScheduler(modelName=BERT_MODEL):
+    return __schedulers.get(modelName)
+
+
+def stopEncodeScheduler(modelName=BERT_MODEL):
+    with __encoderLock:
+        scheduler = __schedulers.pop(modelName, None)
+    if scheduler is not None:
+        scheduler.close()
+
+
+def __resetAfterFork():
+    __queryCache._afterFork()
+    for scheduler in __schedulers.values():
+        scheduler._afterFork()
+
+
+os.register_at_fork(after_in_child=__resetAfterFork)
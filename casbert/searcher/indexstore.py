@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import warnings
+import numpy as np
+import torch
+from ..general import CURRENT_PATH, RESOURCE_DIR
+from ..colls.store import fileFingerprint
+
+INDEX_PT = 'casbert_pmr.pt'
+INDEX_STORE_DIR = 'casbert_pmr'
+INDEX_STORE_MANIFEST = 'manifest.json'
+INDEX_STORE_VERSION = 1
+
+# An index store is a directory holding, for each entity (variable, cellml, ...):
+# - <entity>.ids.json   : list of entity ids in embedding row order
+# - <entity>.class.json : the 'class' dictionary of the index
+# - <entity>.<type>.npy : L2-normalised float32 matrix of each indexType
+# and a manifest.json describing them, with the fingerprint of the source
+# casbert_pmr.pt. The matrices are opened with mmap, so every process loading
+# the store shares one page-cache copy. A store is written to a directory next
+# to it and swapped in when complete, so the files mapped by running processes
+# are never overwritten.
+
+
+def getIndexStorePath():
+    return os.path.join(CURRENT_PATH, RESOURCE_DIR, INDEX_STORE_DIR)
+
+
+def getIndexPtPath():
+    return os.path.join(CURRENT_PATH, RESOURCE_DIR, INDEX_PT)
+
+
+def convertIndex(ptPath=None, storePath=None):
+    """Convert casbert_pmr.pt to an index store at storePath."""
+    ptPath = ptPath if ptPath is not None else getIndexPtPath()
+    storePath = storePath if storePath is not None else getIndexStorePath()
+    tmpPath, oldPath = storePath + '.tmp', storePath + '.old'
+    for path in [tmpPath, oldPath]:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(tmpPath)
+    indexes = torch.load(ptPath, map_location=torch.device('cpu'))
+
+    manifest = {'version': INDEX_STORE_VERSION, 'source': fileFingerprint(ptPath), 'entities': {}}
+    for entity, index in indexes.items():
+        entry = {'ids': entity + '.ids.json',
+                 'class': entity + '.class.json', 'embedding': {}}
+        with open(os.path.join(tmpPath, entry['ids']), 'w') as fp:
+            json.dump(list(index['id']), fp)
+        with open(os.path.join(tmpPath, entry['class']), 'w') as fp:
+            json.dump(index['class'], fp)
+        for indexType, embedding in index['embedding'].items():
+            matrix = torch.nn.functional.normalize(
+                embedding.float(), p=2, dim=1).numpy()
+            file = '%s.%s.npy' % (entity, indexType)
+            np.save(os.path.join(tmpPath, file), np.ascontiguousarray(matrix))
+            entry['embedding'][indexType] = {
+                'file': file, 'shape': list(matrix.shape), 'dtype': str(matrix.dtype)}
+        manifest['entities'][entity] = entry
+    with open(os.path.join(tmpPath, INDEX_STORE_MANIFEST), 'w') as fp:
+        json.dump(manifest, fp)
+    # a directory can not replace a non empty one, so the old store is moved
+    # aside first; processes mapping its files keep reading them until they close
+    if os.path.exists(storePath):
+        os.replace(storePath, oldPath)
+    os.replace(tmpPath, storePath)
+    if os.path.exists(oldPath):
+        shutil.rmtree(oldPath)
+    return storePath
+
+
+def isIndexStore(storePath=None, ptPath=None):
+    """Whether an index store exists and was converted from the current casbert_pmr.pt.
+
+    A store whose source fingerprint differs from ptPath, e.g. after
+    updateIndexes extracted a new one, is stale and ignored.
+    """
+    storePath = storePath if storePath is not None else getIndexStorePath()
+    ptPath = ptPath if ptPath is not None else getIndexPtPath()
+    manifestPath = os.path.join(storePath, INDEX_STORE_MANIFEST)
+    if not os.path.exists(manifestPath):
+        return False
+    source = fileFingerprint(ptPath)
+    if source is None:
+        return True
+    with open(manifestPath, 'r') as fp:
+        manifest = json.load(fp)
+    if manifest.get('source') != source:
+        warnings.warn('%s was not converted from the current %s, run convertIndex again' % (storePath, ptPath))
+        return False
+    return True
+
+
+def loadIndexEntity(entity, storePath=None):
+    """Load one entity index with the same keys as an entry of casbert_pmr.pt.
+
+    Embeddings are read-only tensors backed by mmap, and the entry is
+    flagged 'normalised' so PmrIndex does not copy them to normalise again.
+    """
+    storePath = storePath if storePath is not None else getIndexStorePath()
+    with open(os.path.join(storePath, INDEX_STORE_MANIFEST), 'r') as fp:
+        manifest = json.load(fp)
+    if manifest['version'] != INDEX_STORE_VERSION:
+        raise ValueError('Unsupported index store version: %s' % manifest['version'])
+    entry = manifest['entities'][entity]
+    with open(os.path.join(storePath, entry['ids']), 'r') as fp:
+        ids = json.load(fp)
+    with open(os.path.join(storePath, entry['class']), 'r') as fp:
+        classes = json.load(fp)
+    embedding = {}
+    for indexType, matrix in entry['embedding'].items():
+        array = np.load(os.path.join(storePath, matrix['file']), mmap_mode='r')
+        with warnings.catch_warnings():
+            # the mapping is read only, torch warns since tensors are writable
+            warnings.simplefilter('ignore', UserWarning)
+            embedding[indexType] = torch.from_numpy(array)
+    return {'id': ids, 'class': classes, 'embedding': embedding, 'normalised': True}
+
+
+def loadIndexes(storePath=None):
+    storePath = storePath if storePath is not None else getIndexStorePath()
+    with open(os.path.join(storePath, INDEX_STORE_MANIFEST), 'r') as fp:
+        manifest = json.load(fp)
+    return {entity: loadIndexEntity(entity, storePath) for entity in manifest['entities']}
@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import numpy as np
+import regex as re
+
+__tokenPattern = re.compile(r'[\p{L}\p{N}]+')
+
+
+def tokenise(text):
+    """Lower case alphanumeric tokens; '_', ':', '/' and spaces all separate tokens."""
+    return __tokenPattern.findall(text.lower())
+
+
+class Bm25Index:
+    """Okapi BM25 over the text of the entities of a PmrIndex.
+
+    The inverted index is stored in CSR form: the postings of term t are
+    docIds[indptr[t]:indptr[t+1]] with their BM25 weights in weights. The
+    weights already include idf and length normalisation, so scoring a
+    query is a sum of posting slices. source is the fingerprint of the
+    resources the texts were taken from, saved with the index.
+    """
+
+    def __init__(self, ids, vocab, indptr, docIds, weights, k1=1.2, b=0.75, source=None):
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+        self.source = source
+        self._vocab = vocab if isinstance(vocab, dict) else {t: i for i, t in enumerate(vocab)}
+        self._indptr = indptr
+        self._docIds = docIds
+        self._weights = weights
+
+    @property
+    def numDocs(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, texts, k1=1.2, b=0.75, source=None):
+        """Build from entity ids and their texts, both in row order."""
+        vocab, postings, docLens = {}, [], []
+        for docId, text in enumerate(texts):
+            tokens = tokenise(text)
+            docLens += [len(tokens)]
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                if token not in vocab:
+                    vocab[token] = len(vocab)
+                    postings += [[]]
+                postings[vocab[token]] += [(docId, tf)]
+
+        numDocs = len(ids)
+        docLens = np.array(docLens, dtype=np.float32)
+        avgLen = float(docLens.mean()) if numDocs > 0 and docLens.sum() > 0 else 1.0
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        docIds = np.empty(indptr[-1], dtype=np.int32)
+        weights = np.empty(indptr[-1], dtype=np.float32)
+        for termId, posting in enumerate(postings):
+            docs = np.array([d for d, _ in posting], dtype=np.int32)
+            tfs = np.array([tf for _, tf in posting], dtype=np.float32)
+            df = len(posting)
+            idf = math.log(1 + (numDocs - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * docLens[docs] / avgLen)
+            docIds[indptr[termId]:indptr[termId+1]] = docs
+            weights[indptr[termId]:indptr[termId+1]] = idf * tfs * (k1 + 1) / (tfs + norm)
+        return cls(list(ids), vocab, indptr, docIds, weights, k1, b, source)
+
+    def save(self, path):
+        vocab = sorted(self._vocab, key=self._vocab.get)
+        with open(path, 'wb') as fp:
+            np.savez(fp, ids=np.array(self.ids, dtype=str), vocab=np.array(vocab, dtype=str),
+                     indptr=self._indptr, docIds=self._docIds, weights=self._weights,
+                     params=np.array([self.k1, self.b]), source=np.array(json.dumps(self.source)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            k1, b = data['params'].tolist()
+            # indexes saved without a source are rebuilt by loadOrBuildBm25
+            source = json.loads(str(data['source'])) if 'source' in data.files else None
+            return cls(data['ids'].tolist(), data['vocab'].tolist(), data['indptr'],
+                       data['docIds'], data['weights'], k1, b, source)
+
+    def getScores(self, query):
+        """Return the BM25 score of every row for query."""
+        scores = np.zeros(self.numDocs, dtype=np.float32)
+        for token in set(tokenise(query)):
+            termId = self._vocab.get(token)
+            if termId is None:
+                continue
+            start, end = self._indptr[termId], self._indptr[termId+1]
+            # a term has at most one posting per row, so fancy += is safe
+            scores[self._docIds[start:end]] += self._weights[start:end]
+        return scores
+
+    def getMatches(self, query):
+        """Return the rows containing every token of query (Boolean AND)."""
+        rows = None
+        for token in set(tokenise(query)):
+            termId = self._vocab.get(token)
+            if termId is None:
+                return np.empty(0, dtype=np.int32)
+            docs = self._docIds[self._indptr[termId]:self._indptr[termId+1]]
+            rows = docs if rows is None else np.intersect1d(rows, docs, assume_unique=True)
+        return np.sort(rows) if rows is not None else np.empty(0, dtype=np.int32)
+
+    def search(self, query, topK, rowMask=None):
+        """Return (scores, rows) of the best topK rows with a positive score.
+
+        rowMask ==> optional boolean array of numDocs, only its True rows are returned
+        """
+        scores = self.getScores(query)
+        rows = np.flatnonzero(scores > 0 if rowMask is None else (scores > 0) & rowMask)
+        if len(rows) > topK:
+            rows = rows[np.argpartition(-scores[rows], topK - 1)[:topK]]
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return scores[rows].tolist(), rows.tolist()
+
+    def searchEntities(self, query, topK, rowMask=None):
+        return [self.ids[row] for row in self.search(query, topK, rowMask)[1]]
+
+
+def loadOrBuildBm25(path, ids, getTexts, k1=1.2, b=0.75, source=None):
+    """Load the index at path if it covers ids, otherwise build and save it.
+
+    source ==> fingerprint of the resources the texts are taken from; an index
+               saved from other resources, e.g. before updateIndexes changed
+               names or titles, is rebuilt
+    getTexts is only called when the index has to be built.
+    """
+    if os.path.exists(path):
+        index = Bm25Index.load(path)
+        if index.ids == list(ids) and index.k1 == k1 and index.b == b and index.source == source:
+            return index
+    index = Bm25Index.build(ids, getTexts(), k1, b, source)
+    index.save(path)
+    return index
@@ -7,40 +7,151 @@ from ..colls.sedml import Sedmls
 from ..colls.workspace import Workspaces
 from ..colls.component import Components
 from ..colls.image import Images
+from ..colls.pmrcollection import PmrCollection
+from ..colls.store import fileFingerprint
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
+import warnings
+import weakref
+import numpy as np
 import torch
-from sentence_transformers import SentenceTransformer, util
+from .encoder import getEncoder, getQueryCache, getEncodeScheduler, startEncodeScheduler, BERT_MODEL
+from .backend import createBackend, BACKEND_EXACT, BACKEND_IVF
+from .indexstore import isIndexStore, loadIndexEntity, getIndexPtPath, getIndexStorePath, \
+    INDEX_STORE_MANIFEST
+from .lexical import loadOrBuildBm25
+from .cardstore import ResultCardStore
 
 
 class PmrIndex:
-    def __init__(self, index):
+    def __init__(self, index, model=None, modelName=BERT_MODEL, queryCache=None,
+                 name=None, backend=BACKEND_EXACT, backendParams=None):
         self._entityIds = index['id']
         self._entityClasses = index['class']
         self._entityEmbedding = index['embedding']
-
-        BERTModel = 'multi-qa-MiniLM-L6-cos-v1'
-        self._model = SentenceTransformer(BERTModel)
-
-    def searchEntities(self, query, topK, minSim, indexType):
-        return self._entitySearch(query, topK, minSim, indexType)
-
-    def _entitySearch(self, query, topK, minSim, indexType):
+        # embeddings from an index store are already L2-normalised
+        self._isNormalised = index.get('normalised', False)
+
+        # the encoder is shared between indexes, so a process holds one model,
+        # and it is only loaded when a query is first encoded
+        self._modelName = modelName
+        self.__model = model
+        self._queryCache = queryCache if queryCache is not None else getQueryCache()
+
+        # search backends are built per indexType on first use
+        self._name = name
+        self._backend = backend
+        self._backendParams = backendParams if backendParams is not None else {}
+        self._backends = {}
+        self.__backendLock = threading.Lock()
+
+    @property
+    def _model(self):
+        if self.__model is None:
+            self.__model = getEncoder(self._modelName)
+        return self.__model
+
+    @property
+    def entityIds(self):
+        return self._entityIds
+
+    def encodeQuery(self, query):
+        # with a started EncodeScheduler, concurrent searches share forward passes
+        scheduler = getEncodeScheduler(self._modelName)
+        if scheduler is not None:
+            return scheduler.encode(query)
+        return self._queryCache.encode(self._model, self._modelName, query)
+
+    def getBackend(self, indexType):
+        backend = self._backends.get(indexType)
+        if backend is None:
+            # built once, even when the first searches come from several threads
+            with self.__backendLock:
+                if indexType not in self._backends:
+                    self._backends[indexType] = self.__createBackend(indexType)
+                backend = self._backends[indexType]
+        return backend
+
+    def __createBackend(self, indexType):
+        path = None
+        if self._name is not None:
+            path = os.path.join(CURRENT_PATH, RESOURCE_DIR, 'casbert_%s_%s_%s.pt' % (
+                self._backend if isinstance(self._backend, str) else self._backend.__name__,
+                self._name, indexType))
+        backend = createBackend(
+            self._backend, self._entityEmbedding[indexType], path=path,
+            normalised=self._isNormalised, **self._backendParams)
+        # the backend keeps its own normalised copy, so the raw matrix is released,
+        # but only once it is built: a failed build can be retried
+        self._entityEmbedding.pop(indexType)
+        return backend
+
+    def encodeQueries(self, queries):
+        return self._queryCache.encodeBatch(self._model, self._modelName, queries)
+
+    def warmup(self, encoder=True):
+        """Build the backends of every index type, and load the encoder."""
+        for indexType in list(self._entityEmbedding.keys()):
+            self.getBackend(indexType)
+        if encoder:
+            self._model
+        return self
+
+    def scoreRows(self, query, rows, indexType):
+        """Cosine similarity of query with the given rows only, in the order of rows."""
+        rows = torch.as_tensor(rows, dtype=torch.long)
+        return self.getBackend(indexType).scoreRows(
+            self.encodeQuery(query).unsqueeze(0), rows)[0].tolist()
+
+    def searchEntities(self, query, topK, minSim, indexType, rowMask=None):
+        return self._entitySearch(query, topK, minSim, indexType, rowMask)
+
+    def _entitySearch(self, query, topK, minSim, indexType, rowMask=None):
         """
         In this approach:
         1. Get vector of query
-        2. Get similar entities using cosine similarity
+        2. Get similar entities using the backend (cosine similarity by default),
+           only over the rows allowed by rowMask (a boolean array of rows) if given
         3. Return topK result in descending
         """
-        textEmbedding = self._model.encode(query, convert_to_tensor=True)
-        # We use cosine-similarity and torch.topk to find the highest top_k scores
-        cosScores = util.pytorch_cos_sim(
-            textEmbedding, self._entityEmbedding[indexType])[0]
-        topResults = torch.topk(cosScores, k=topK)
+        textEmbedding = self.encodeQuery(query)
+        return self._selectEntities(self.getBackend(indexType).search(
+            textEmbedding.unsqueeze(0), topK, self.__asMask(rowMask)), minSim)[0]
+
+    def searchEntitiesBatch(self, queries, topK, minSim, indexType, rowMask=None):
+        return self._entitySearchBatch(queries, topK, minSim, indexType, rowMask)
+
+    def _entitySearchBatch(self, queries, topK, minSim, indexType, rowMask=None):
+        """
+        Batched version of _entitySearch:
+        1. Get vectors of all queries in one encode call
+        2. Score all queries with one backend call
+        3. Return topK result in descending for each query
+        """
+        if len(queries) == 0:
+            return []
+        return self.searchEmbeddings(self.encodeQueries(queries), topK, minSim, indexType, rowMask)
+
+    def searchEmbeddings(self, embeddings, topK, minSim, indexType, rowMask=None):
+        """Search with already encoded (numQueries, dim) queries, e.g. shared between indexes."""
+        return self._selectEntities(self.getBackend(indexType).search(
+            embeddings, topK, self.__asMask(rowMask)), minSim)
+
+    def __asMask(self, rowMask):
+        # numpy masks are shared with torch, not copied
+        return torch.as_tensor(rowMask, dtype=torch.bool) if rowMask is not None else None
+
+    def _selectEntities(self, topResults, minSim):
         results = []
-        for rank, (score, idx) in enumerate(zip(topResults[0], topResults[1])):
-            if score < minSim:
-                break
-            results += [self._entityIds[idx]]
+        for scores, idxs in zip(*topResults):
+            result = []
+            for score, idx in zip(scores, idxs):
+                if score < minSim:
+                    break
+                result += [self._entityIds[idx]]
+            results += [result]
         return results
 
 
@@ -49,17 +160,42 @@ class Searcher:
     ALG_BOOL = 0
     ALG_BM25 = 1
     ALG_CASBERT = 2
+    ALG_HYBRID = 3
+
+    # HYBRID SCORE FUSION
+    FUSION_RRF = 'rrf'
+    FUSION_WEIGHTED = 'weighted'
 
     IDX_CLASS = 'class'
     IDX_CLASS_PREDICATE = 'class_predicate'
 
-    def __init__(self, algorithm=ALG_CASBERT, indexType=IDX_CLASS):
+    # NEAREST NEIGHBOUR BACKENDS
+    BACKEND_EXACT = BACKEND_EXACT
+    BACKEND_IVF = BACKEND_IVF
+
+    def __init__(self, algorithm=ALG_CASBERT, indexType=IDX_CLASS, model=None, modelName=BERT_MODEL, queryCacheSize=None,
+                 backend=BACKEND_EXACT, backendParams=None, hybridParams=None, encodeWindow=None):
         """Initialise ...
 
         Parameters
         ----------
         algorithm ==> [Searcher.ALG_BOOL, Searcher.ALG_BM25, Searcher.ALG_CASBERT]
+                      Searcher.ALG_BM25 searches a lexical index and does not load the model
         indexType ==> [Searcher.IDX_CLASS, Searcher.IDX_CLASS_PREDICATE]
+        model ==> a loaded SentenceTransformer to share; None looks up modelName
+        modelName ==> name of the SentenceTransformer model
+        queryCacheSize ==> number of query embeddings kept in the shared LRU cache, 0 disables it
+        backend ==> [Searcher.BACKEND_EXACT, Searcher.BACKEND_IVF]
+        backendParams ==> backend settings, e.g. {'nlist': 256, 'nprobe': 8} for Searcher.BACKEND_IVF,
+                          {'precision': 'float16'} or {'precision': 'int8'} to keep a reduced precision matrix
+        hybridParams ==> settings of Searcher.ALG_HYBRID, keys and defaults:
+                         'lexical': Searcher.ALG_BM25 or Searcher.ALG_BOOL candidate selection (ALG_BM25)
+                         'candidates': maximum number of lexical candidates scored densely (1000)
+                         'fusion': Searcher.FUSION_RRF or Searcher.FUSION_WEIGHTED (FUSION_RRF)
+                         'weight': weight of the cosine similarity for FUSION_WEIGHTED (0.5)
+                         'rrfK': constant of reciprocal rank fusion (60)
+        encodeWindow ==> e.g. {'maxWait': 0.003, 'maxBatchSize': 32} to encode the queries of
+                         concurrent searches in micro-batches, see startEncodeScheduler
         ....
 
         Returns
@@ -68,186 +204,411 @@ class Searcher:
             a list of strings used that are the header columns
         """
         self.algorithm = algorithm
-        indexPath = os.path.join(CURRENT_PATH, RESOURCE_DIR, 'casbert_pmr.pt')
-        indexes = torch.load(indexPath, map_location=torch.device('cpu'))
-
-        self.idxVar = PmrIndex(indexes['variable'])
-        self.idxCellml = PmrIndex(indexes['cellml'])
-        self.idxSedml = PmrIndex(indexes['sedml'])
-        self.idxImage = PmrIndex(indexes['image'])
-        self.idxComp = PmrIndex(indexes['component'])
-        
-        self.clusterer = loadJson(RESOURCE_DIR, RS_CLUSTERER)
-        self.sysUnits = Units(RESOURCE_DIR, RS_UNIT)
-        self.sysMaths = Maths(RESOURCE_DIR, RS_MATH)
-        self.sysSedmls = Sedmls(RESOURCE_DIR, RS_SEDML)
-        self.sysVars = Variables(self.sysMaths, RESOURCE_DIR, RS_VARIABLE)
-        self.sysComps = Components(RESOURCE_DIR, RS_COMPONENT)
-        self.sysWks = Workspaces(RESOURCE_DIR, RS_WORKSPACE)
-        self.sysCellmls = Cellmls(RESOURCE_DIR, RS_CELLML)
-        self.sysImages = Images(RESOURCE_DIR, RS_IMAGE)
-
-    def search(self, query, top=20, minSim=0.5, indexType='class_predicate'):
-        # classify the query vertically
-        # queryTypes = self.__classify(query)
-
-        # get result based on the classification results
-        # temporarily just variable search :)
-        # the sedml search temporarily is modified variable search
-
-        # return self.__searchPlots(query, top, minSim)
-
-        return self.__getVariables(query, top, minSim, indexType=indexType)
-
-    def __getVariables(self, query, top, minSim, indexType):
-        resultVars = self.idxVar.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
-        result = {}
-        for varId in resultVars:
-            varData = {}
-            # get main information
-            varData['name'] = self.sysVars.getName(varId)
-            varData['init'] = self.sysVars.getInit(varId)
-            varData['type'] = self.sysVars.getType(varId)
-            if varData['type'] == 'state':
-                varData['rate'] = self.sysVars.getRate(varId)
-            # get units
-            varUnit = self.sysVars.getUnit(varId)
-            varData['unit'] = {'name': self.sysUnits.getNames(
-                varUnit)[0], 'text': self.sysUnits.getText(varUnit)}
-            # get math
-            varData['math'] = self.sysVars.getMaths(varId)
-            # get maths' dependents
-            varData['dependent'] = self.getEntityDependencyMaths(varId)
-            # self.sysVars.getDependents(varId, varDep=varData['dependent'])
-            # get leaves
-            varData['rdfLeaves'] = self.sysVars.getObjLeaves(varId)
-            # get sedmls and plot
-            varData['plot'] = [os.path.join(
-                CURRENT_PATH, RESOURCE_DIR, SEDML_IMG_DIR, plot+IMG_EXT) for plot in self.sysVars.getPlots(varId)]
-            varData['sedml'] = [os.path.join(PMR_SERVER, self.sysSedmls.getUrl(
-                plot.split('.')[0])) for plot in self.sysVars.getPlots(varId)]
-            #get components
-            varData['component'] = self.sysComps.getName(
-                self.sysVars.getCompId(varId))
-            varData['compLeaves'] = self.sysComps.getObjLeaves(
-                self.sysVars.getCompId(varId))
-            # get cellml, workspace, images
-            cellmlId = self.sysComps.getCellml(self.sysVars.getCompId(varId))
-            varData['cellmlUrl'] = PMR_SERVER + \
-                self.sysCellmls.getUrl(id=cellmlId)
-            varData['cellmlTitle'] = self.sysCellmls.getTitle(id=cellmlId)
-            # varData['cellmlImages'] = [varData['cellmlUrl'][:varData['cellmlUrl'].rfind('/')+1]+self.sysImages.getPath(id) for id in self.sysCellmls.getImages(id=cellmlId)]
-            varData['workspaceUrl'] = PMR_SERVER + \
-                self.sysCellmls.getWorkspace(id=cellmlId)
-            # get exposures
-            exposures = self.sysWks.getExposures(
-                url=self.sysCellmls.getWorkspace(id=cellmlId))
-            varData['exposures'] = [PMR_SERVER +
-                                    exposure for exposure in exposures.keys()]
-            # get similar cellml using cluster
-            varData['similarCellmls'] = self.getSimilarCellmls(varId)
-
-            # get cellml images
-            cellmlImages = []
-            for imageId in self.sysCellmls.getImages(id=cellmlId):
-                imagePath = os.path.join(CURRENT_PATH, WORKSPACE_DIR, os.path.dirname(
-                    self.sysCellmls.getPath(id=cellmlId)), self.sysImages.getPath(imageId))
-                if os.path.exists(imagePath):
-                    cellmlImages += [os.path.join(os.path.dirname(
-                        varData['cellmlUrl']), self.sysImages.getPath(imageId))]
-            # get cellml images from other cellml / workspaces if not found
-            if len(cellmlImages) == 0:
-                for similarCellml in varData['similarCellmls']:
-                    for imageId in self.sysCellmls.getImages(url=similarCellml):
-                        imagePath = os.path.join(CURRENT_PATH, WORKSPACE_DIR, os.path.dirname(
-                            self.sysCellmls.getPath(url=similarCellml)), self.sysImages.getPath(imageId))
-                        if os.path.exists(imagePath):
-                            cellmlImages += [os.path.join(os.path.dirname(
-                                PMR_SERVER + similarCellml), self.sysImages.getPath(imageId))]
-            varData['cellmlImages'] = cellmlImages
-
-            result[varId] = varData
-
-        return result
-
-    def __searchPlots(self, query, top, minSim, indexType):
-        def getVarDataForPlot(varId):
-            varData = {}
-            varData['name'] = self.sysVars.getName(varId)
-            varData['init'] = self.sysVars.getInit(varId)
-            varData['type'] = self.sysVars.getType(varId)
-            if varData['type'] == 'state':
-                varData['rate'] = self.sysVars.getRate(varId)
-            varUnit = self.sysVars.getUnit(varId)
-            varData['unit'] = {'name': self.sysUnits.getNames(
-                varUnit)[0], 'text': self.sysUnits.getText(varUnit)}
-            varData['math'] = self.sysVars.getMaths(varId)
-            varData['dependent'] = {}
-            self.sysVars.getDependents(varId, varDep=varData['dependent'])
-            varData['rdfLeaves'] = self.sysVars.getObjLeaves(varId)
-            return varData
+        self.hybridParams = {'lexical': self.ALG_BM25, 'candidates': 1000,
+                             'fusion': self.FUSION_RRF, 'weight': 0.5, 'rrfK': 60, **(hybridParams or {})}
+        self.queryCache = getQueryCache()
+        if queryCacheSize is not None:
+            self.queryCache.resize(queryCacheSize)
+        if encodeWindow is not None:
+            startEncodeScheduler(modelName, model, **encodeWindow)
+
+        # indexes and collections are loaded on first access, see __getattr__ and warmup
+        self.__model = model
+        self.__modelName = modelName
+        self.__backend = backend
+        self.__backendParams = backendParams if backendParams is not None else {}
+        self.__indexes = None
+        self.__executor = None
+        self.__loadLock = threading.RLock()
+        Searcher.__instances.add(self)
+        self.__loaders = {
+            'idxVar': lambda: self.__createIndex('variable'),
+            'idxCellml': lambda: self.__createIndex('cellml'),
+            'idxSedml': lambda: self.__createIndex('sedml'),
+            'idxImage': lambda: self.__createIndex('image'),
+            'idxComp': lambda: self.__createIndex('component'),
+            'clusterer': self.__loadClusterer,
+            'sysUnits': lambda: Units(RESOURCE_DIR, RS_UNIT),
+            'sysMaths': lambda: Maths(RESOURCE_DIR, RS_MATH),
+            'sysSedmls': lambda: Sedmls(RESOURCE_DIR, RS_SEDML),
+            'sysVars': lambda: Variables(self.sysMaths, RESOURCE_DIR, RS_VARIABLE),
+            'sysComps': lambda: Components(RESOURCE_DIR, RS_COMPONENT),
+            'sysWks': lambda: Workspaces(RESOURCE_DIR, RS_WORKSPACE),
+            'sysCellmls': lambda: Cellmls(RESOURCE_DIR, RS_CELLML),
+            'sysImages': lambda: Images(RESOURCE_DIR, RS_IMAGE),
+            'bm25Var': lambda: self.__createBm25('variable'),
+            'bm25Cellml': lambda: self.__createBm25('cellml'),
+            'bm25Sedml': lambda: self.__createBm25('sedml'),
+            'bm25Image': lambda: self.__createBm25('image'),
+            'bm25Comp': lambda: self.__createBm25('component'),
+            'resultCards': self.__loadResultCards,
+            'varColumns': lambda: self.sysVars.getColumns(self.idxVar.entityIds, self.sysUnits, self.sysComps),
+        }
+
+    # attribute names of the dense and BM25 indexes of each entity type
+    ENTITY_INDEXES = {
+        'variable': ('idxVar', 'bm25Var'),
+        'cellml': ('idxCellml', 'bm25Cellml'),
+        'sedml': ('idxSedml', 'bm25Sedml'),
+        'image': ('idxImage', 'bm25Image'),
+        'component': ('idxComp', 'bm25Comp'),
+    }
+
+    # attributes needed by the search methods of each entity type
+    WARMUP_TYPES = {
+        'variable': ['idxVar', 'resultCards', 'clusterer', 'sysUnits', 'sysMaths', 'sysSedmls', 'sysVars',
+                     'sysComps', 'sysWks', 'sysCellmls', 'sysImages', 'varColumns'],
+        'plot': ['idxVar', 'sysUnits', 'sysMaths', 'sysSedmls', 'sysVars', 'sysWks', 'sysCellmls'],
+        'cellml': ['idxCellml', 'sysMaths', 'sysSedmls', 'sysVars', 'sysWks', 'sysCellmls', 'sysImages'],
+        'sedml': ['idxSedml', 'sysMaths', 'sysSedmls', 'sysVars', 'sysWks', 'sysCellmls'],
+        'image': ['idxImage', 'sysWks', 'sysCellmls', 'sysImages'],
+        'component': ['idxComp', 'idxVar', 'sysMaths', 'sysVars', 'sysComps', 'sysWks', 'sysCellmls'],
+    }
+
+    def __getattr__(self, name):
+        # only called when name is not loaded yet
+        if name.startswith('_') or name not in self.__loaders:
+            raise AttributeError("'%s' object has no attribute '%s'" % (
+                self.__class__.__name__, name))
+        with self.__loadLock:
+            if name not in self.__dict__:
+                self.__dict__[name] = self.__loaders[name]()
+        return self.__dict__[name]
+
+    def __loadClusterer(self):
+        ensureData()
+        return loadJson(RESOURCE_DIR, RS_CLUSTERER)
+
+    def __createIndex(self, name):
+        ensureData()
+        # prefer the mmap index store, see casbert.searcher.indexstore.convertIndex,
+        # unless casbert_pmr.pt changed since it was converted
+        if self.__indexes is None and isIndexStore():
+            index = loadIndexEntity(name)
+        else:
+            if self.__indexes is None:
+                self.__indexes = torch.load(getIndexPtPath(), map_location=torch.device('cpu'))
+            # popping lets each entity's tensors go with its PmrIndex
+            index = self.__indexes.pop(name)
+        return PmrIndex(index, self.__model, self.__modelName, name=name,
+                        backend=self.__backend, backendParams=self.__backendParams)
+
+    # resources the result cards are computed from
+    RESULT_CARD_SOURCES = [RS_UNIT, RS_MATH, RS_SEDML, RS_VARIABLE, RS_COMPONENT, RS_WORKSPACE,
+                           RS_CELLML, RS_IMAGE, RS_CLUSTERER]
+
+    # resources the texts of the BM25 indexes are taken from
+    BM25_SOURCES = [RS_SEDML, RS_VARIABLE, RS_COMPONENT, RS_CELLML, RS_IMAGE]
+
+    def __getFingerprint(self, sources):
+        # fingerprints of the resource files sources and of the indexes, whichever is loaded
+        files = {file: os.path.join(CURRENT_PATH, RESOURCE_DIR, file) for file in sources}
+        files['index'] = getIndexPtPath()
+        files['indexStore'] = os.path.join(getIndexStorePath(), INDEX_STORE_MANIFEST)
+        return {name: fileFingerprint(path) for name, path in files.items()}
+
+    def __loadResultCards(self):
+        path = os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_RESULT_CARDS)
+        if not os.path.exists(path):
+            return None
+        store = ResultCardStore(path)
+        # cards built before the indexes or collections changed are not used
+        if store.fingerprint != self.__getFingerprint(self.RESULT_CARD_SOURCES):
+            warnings.warn('%s does not match the current indexes or collections, run buildResultCards again' % path)
+            return None
+        return store
+
+    def buildResultCards(self, varIds=None):
+        """Precompute getEntityMetadata of every variable into the result card store.
+
+        searchVariables then answers with one store lookup per hit. Rebuild
+        it after the indexes or collections are updated.
+        """
+        varIds = varIds if varIds is not None else self.idxVar.entityIds
+        path = os.path.join(CURRENT_PATH, RESOURCE_DIR, RS_RESULT_CARDS)
+        store = ResultCardStore.build(
+            path, ((varId, self.getEntityMetadata(varId)) for varId in varIds),
+            self.__getFingerprint(self.RESULT_CARD_SOURCES))
+        with self.__loadLock:
+            self.__dict__['resultCards'] = store
+        return store
+
+    def __createBm25(self, name):
+        idx = getattr(self, self.ENTITY_INDEXES[name][0])
+        path = os.path.join(CURRENT_PATH, RESOURCE_DIR, 'casbert_bm25_%s.npz' % name)
+        return loadOrBuildBm25(path, idx.entityIds, lambda: [
+            self.__getEntityText(name, idx, entityId) for entityId in idx.entityIds],
+            source=self.__getFingerprint(self.BM25_SOURCES))
+
+    def __getEntityText(self, name, idx, entityId):
+        """Text used by the lexical index: names, titles and class labels and ids."""
+        texts = []
+
+        def add(getText):
+            # entities may miss metadata, they are then indexed with what is left
+            try:
+                text = getText()
+                if isinstance(text, str):
+                    texts.append(text)
+            except Exception:
+                pass
+
+        try:
+            classes = idx._entityClasses[entityId]['classes']
+        except Exception:
+            classes = {}
+        for classId, attr in classes.items():
+            texts += [classId]
+            add(lambda: attr['name'])
+        if name == 'variable':
+            add(lambda: self.sysVars.getName(entityId))
+            add(lambda: self.sysComps.getName(self.sysVars.getCompId(entityId)))
+            add(lambda: self.sysCellmls.getTitle(
+                id=self.sysComps.getCellml(self.sysVars.getCompId(entityId))))
+        elif name == 'cellml':
+            add(lambda: self.sysCellmls.getTitle(url=entityId))
+            add(lambda: self.sysCellmls.getAbstract(url=entityId))
+        elif name == 'sedml':
+            add(lambda: self.sysCellmls.getTitle(
+                url=self.sysSedmls.getCellmlUrl(self.sysCellmls, id=entityId)))
+        elif name == 'image':
+            add(lambda: self.sysImages.getTitle(entityId))
+        elif name == 'component':
+            add(lambda: self.sysComps.getName(entityId))
+        return ' '.join(texts)
+
+    def __searchEntities(self, name, query, top, minSim, indexType, rowMask=None):
+        """Get ids of the entities of type name matching query using self.algorithm.
+
+        minSim only applies to cosine similarities, BM25 returns every
+        row with a positive score. rowMask (a boolean array over the rows
+        of the entity index) restricts the rows before the top ones are
+        selected.
+        """
+        idxName, bm25Name = self.ENTITY_INDEXES[name]
+        if self.algorithm == self.ALG_BM25:
+            return getattr(self, bm25Name).searchEntities(query, top, rowMask)
+        if self.algorithm == self.ALG_HYBRID:
+            return self.__hybridSearch(name, query, top, minSim, indexType, rowMask)
+        return getattr(self, idxName).searchEntities(
+            query, topK=top, minSim=minSim, indexType=indexType, rowMask=rowMask)
+
+    def __searchEntitiesBatch(self, name, queries, top, minSim, indexType, rowMask=None):
+        idxName, bm25Name = self.ENTITY_INDEXES[name]
+        if self.algorithm == self.ALG_BM25:
+            bm25 = getattr(self, bm25Name)
+            return [bm25.searchEntities(query, top, rowMask) for query in queries]
+        if self.algorithm == self.ALG_HYBRID:
+            # one encode call for all queries, the per query passes hit the cache
+            getattr(self, idxName).encodeQueries(queries)
+            return [self.__hybridSearch(name, query, top, minSim, indexType, rowMask)
+                    for query in queries]
+        return getattr(self, idxName).searchEntitiesBatch(
+            queries, topK=top, minSim=minSim, indexType=indexType, rowMask=rowMask)
+
+    def __hybridSearch(self, name, query, top, minSim, indexType, rowMask=None):
+        """
+        In this approach:
+        1. Select candidate rows with BM25 (or Boolean AND) over the lexical index
+        2. Get cosine similarity of the query with the candidate rows only
+        3. Fuse lexical and dense scores and return top result in descending
+        A query without lexical candidates falls back to the dense search, so
+        minSim only applies in that case.
+        """
+        idxName, bm25Name = self.ENTITY_INDEXES[name]
+        idx, bm25 = getattr(self, idxName), getattr(self, bm25Name)
+        params = self.hybridParams
+        if params['lexical'] == self.ALG_BOOL:
+            rows = bm25.getMatches(query)
+            if rowMask is not None:
+                rows = rows[rowMask[rows]]
+            lexScores = bm25.getScores(query)[rows]
+            order = np.argsort(-lexScores, kind='stable')[:params['candidates']]
+            rows, lexScores = rows[order].tolist(), lexScores[order].tolist()
+        else:
+            lexScores, rows = bm25.search(query, params['candidates'], rowMask)
+        if len(rows) == 0:
+            return idx.searchEntities(query, topK=top, minSim=minSim, indexType=indexType,
+                                      rowMask=rowMask)
+
+        denseScores = idx.scoreRows(query, rows, indexType)
+        if params['fusion'] == self.FUSION_WEIGHTED:
+            maxLex = max(lexScores) if max(lexScores) > 0 else 1.0
+            scores = [params['weight'] * d + (1 - params['weight']) * l / maxLex
+                      for l, d in zip(lexScores, denseScores)]
+        else:
+            # rows are already in lexical rank order
+            denseRanks = {i: rank for rank, i in enumerate(
+                sorted(range(len(rows)), key=lambda i: -denseScores[i]))}
+            scores = [1 / (params['rrfK'] + i + 1) + 1 / (params['rrfK'] + denseRanks[i] + 1)
+                      for i in range(len(rows))]
+        best = sorted(range(len(rows)), key=lambda i: -scores[i])[:top]
+        return [idx.entityIds[rows[i]] for i in best]
+
+    def warmup(self, types=None, backends=False):
+        """Load indexes and collections now rather than on first use.
+
+        types ==> entity types in Searcher.WARMUP_TYPES (e.g. ['variable', 'cellml'])
+                  or attribute names (e.g. 'sysUnits'); None loads everything the
+                  algorithm uses, BM25 indexes only for ALG_BM25 and ALG_HYBRID;
+                  loading sysVars also builds its dependency graph
+        backends ==> also build the search backend of every index type of the loaded
+                     indexes and load the encoder, e.g. before forking workers
+        """
+        bm25Names = [bm25Name for _, bm25Name in self.ENTITY_INDEXES.values()]
+        if types is None:
+            names = [name for name in self.__loaders if name not in bm25Names]
+        else:
+            names = []
+            for tp in types:
+                names += self.WARMUP_TYPES[tp] if tp in self.WARMUP_TYPES else [tp]
+        if self.algorithm in [self.ALG_BM25, self.ALG_HYBRID]:
+            names += [bm25Name for idxName, bm25Name in self.ENTITY_INDEXES.values()
+                      if idxName in names and bm25Name not in names]
+        for name in names:
+            getattr(self, name)
+        if 'sysVars' in names:
+            self.sysVars.warmup()
+        if backends:
+            for idxName, _ in self.ENTITY_INDEXES.values():
+                if idxName in names:
+                    getattr(self, idxName).warmup(
+                        encoder=self.algorithm in [self.ALG_CASBERT, self.ALG_HYBRID])
+        return self
+
+    def encodeQueries(self, queries):
+        """Encode queries in one forward pass into the shared query cache.
+
+        Every index uses the same encoder and cache, so their searches for
+        these queries then skip encoding.
+        """
+        model = self.__model if self.__model is not None else getEncoder(self.__modelName)
+        return self.queryCache.encodeBatch(model, self.__modelName, queries)
+
+    def startEncodeScheduler(self, maxWait=0.003, maxBatchSize=32):
+        """Micro-batch the query encodes of this Searcher's model, see EncodeScheduler."""
+        return startEncodeScheduler(self.__modelName, self.__model, maxWait, maxBatchSize)
+
+    def getEncodeScheduler(self):
+        return getEncodeScheduler(self.__modelName)
+
+    def getEncodeStats(self):
+        """Queue depth and batch size histograms of the encode scheduler, None if not started."""
+        scheduler = self.getEncodeScheduler()
+        return scheduler.stats() if scheduler is not None else None
+
+    def getQueryCacheStats(self):
+        return self.queryCache.stats()
+
+    def getIndexMemory(self):
+        """Approximate bytes of the declared collection indexes, per loaded collection."""
+        return {name: coll.getIndexMemory() for name, coll in self.__dict__.items()
+                if isinstance(coll, PmrCollection) and len(coll.INDEXES) > 0}
+
+    # entity types of search with the default indexType of their search method
+    SEARCH_TYPES = {
+        'variable': IDX_CLASS_PREDICATE,
+        'cellml': IDX_CLASS,
+        'sedml': IDX_CLASS,
+        'image': IDX_CLASS,
+        'component': IDX_CLASS_PREDICATE,
+    }
+
+    # searchers of this process, reset in the child of a fork, see _afterFork
+    __instances = weakref.WeakSet()
+
+    def _afterFork(self):
+        # the threads of the executor do not survive a fork, so a search in the
+        # child would wait on a pool without threads; a new one is started on use
+        self.__executor = None
+        self.__loadLock = threading.RLock()
+
+    @classmethod
+    def _resetAfterFork(cls):
+        for searcher in list(cls.__instances):
+            searcher._afterFork()
+
+    def __getExecutor(self):
+        with self.__loadLock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=len(self.SEARCH_TYPES), thread_name_prefix='casbert-search')
+        return self.__executor
+
+    def search(self, query, top=20, minSim=0.5, indexType=None, types=None, filters=None):
+        """Search every entity type for query in one call.
+
+        The query is encoded once and that embedding is scored against the
+        index of each type, then the metadata of each type are expanded in
+        parallel threads.
+
+        indexType ==> None for the default of each search method, see Searcher.SEARCH_TYPES
+        types ==> entity types to search, None for all of Searcher.SEARCH_TYPES
+        filters ==> variable filters, see searchVariables
+        Raises ValueError for an empty types, or a type not in Searcher.SEARCH_TYPES.
 
-        resultVars = self.idxVar.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
-        resultPlots = {}
-        # for each variable, identify the plot and store in a resultPlots
-        for varId in resultVars:
-            plots = self.sysVars.getPlots(varId)
-            if len(plots) > 0:
-                for plot in plots:
-                    if plot not in resultPlots:
-                        plotData = {}
-                        plotData['variable'] = {}
-                        sedmlId, plotId = plot.split('.')
-                        varIdsPlot = self.sysSedmls.getVariables(
-                            sedmlId, plot=plotId, collVariable=self.sysVars)
-                        for varIdPlot in varIdsPlot:
-                            if varIdPlot['id'] not in plotData['variable']:
-                                plotData['variable'] += [
-                                    getVarDataForPlot(varIdPlot['id'])]
-                        resultPlots[plot] = plotData
-                        resultPlots[plot]['path'] = os.path.join(
-                            CURRENT_PATH, RESOURCE_DIR, SEDML_IMG_DIR, plot+IMG_EXT)
-                        resultPlots[plot]['url'] = PMR_SERVER + \
-                            self.sysSedmls.getUrl(sedmlId)
-                        resultPlots[plot]['workspaceUrl'] = PMR_SERVER + \
-                            self.sysSedmls.getWorkspace(sedmlId)
-                        cellmlId = self.sysSedmls.getCellmlId(sedmlId)
-                        resultPlots[plot]['cellmlUrl'] = PMR_SERVER + \
-                            self.sysCellmls.getUrl(id=cellmlId)
-                        # get exposures
-                        exposures = self.sysWks.getExposures(
-                            url=self.sysCellmls.getWorkspace(id=cellmlId))
-                        resultPlots[plot]['exposures'] = [
-                            PMR_SERVER + exposure for exposure in exposures.keys()]
-                        # get similar cellml using cluster
-                        similarCellmls = self.__getOtherCellms(cellmlId)
-                        resultPlots[plot]['similarCellmls'] = [
-                            PMR_SERVER + url for url in similarCellmls]
-
-                        # get cellml images
-                        cellmlImages = []
-                        for imageId in self.sysCellmls.getImages(id=cellmlId):
-                            imagePath = os.path.join(CURRENT_PATH, WORKSPACE_DIR, os.path.dirname(
-                                self.sysCellmls.getPath(id=cellmlId)), self.sysImages.getPath(imageId))
-                            if os.path.exists(imagePath):
-                                cellmlImages += [os.path.join(os.path.dirname(
-                                    resultPlots[plot]['cellmlUrl']), self.sysImages.getPath(imageId))]
-                        # get cellml images from other cellml / workspaces if not found
-                        if len(cellmlImages) == 0:
-                            for similarCellml in similarCellmls:
-                                for imageId in self.sysCellmls.getImages(url=similarCellml):
-                                    imagePath = os.path.join(CURRENT_PATH, WORKSPACE_DIR, os.path.dirname(
-                                        self.sysCellmls.getPath(url=similarCellml)), self.sysImages.getPath(imageId))
-                                    if os.path.exists(imagePath):
-                                        cellmlImages += [os.path.join(os.path.dirname(
-                                            PMR_SERVER + similarCellml), self.sysImages.getPath(imageId))]
-                        resultPlots[plot]['cellmlImages'] = cellmlImages
-
-        return resultPlots
+        Returns
+        -------
+        dict
+            {'result': {type: the result of its search method, e.g. searchCellmls},
+             'timings': {'encode': seconds, 'score': {type: seconds},
+                         'metadata': {type: seconds}, 'total': seconds}}
+        """
+        start = time.perf_counter()
+        types = list(self.SEARCH_TYPES) if types is None else [types] if isinstance(types, str) else list(types)
+        if len(types) == 0:
+            raise ValueError('types is empty, expected some of %s' % list(self.SEARCH_TYPES))
+        unknown = [tp for tp in types if tp not in self.SEARCH_TYPES]
+        if len(unknown) > 0:
+            raise ValueError('Unknown types %s, expected some of %s' % (unknown, list(self.SEARCH_TYPES)))
+        # invalid filters fail before any work
+        variableMask = self.getVariableMask(**filters) if 'variable' in types and filters else None
+        timings = {'encode': 0.0, 'score': {}, 'metadata': {}}
+
+        embedding = None
+        if self.algorithm in [self.ALG_CASBERT, self.ALG_HYBRID]:
+            # indexes share the encoder, hybrid searches then hit the query cache
+            embedding = getattr(self, self.ENTITY_INDEXES[types[0]][0]).encodeQueries([query])
+            timings['encode'] = time.perf_counter() - start
+
+        entityIds = {}
+        for tp in types:
+            scoreStart = time.perf_counter()
+            tpIndexType = indexType if indexType is not None else self.SEARCH_TYPES[tp]
+            rowMask = variableMask if tp == 'variable' else None
+            if self.algorithm == self.ALG_CASBERT:
+                entityIds[tp] = getattr(self, self.ENTITY_INDEXES[tp][0]).searchEmbeddings(
+                    embedding, top, minSim, tpIndexType, rowMask)[0]
+            else:
+                entityIds[tp] = self.__searchEntities(tp, query, top, minSim, tpIndexType, rowMask)
+            timings['score'][tp] = time.perf_counter() - scoreStart
+
+        getResults = {'variable': self.__getVariablesResult, 'cellml': self.__getCellmlsResult,
+                      'sedml': self.__getSedmlsResult, 'image': self.__getImagesResult,
+                      'component': self.__getComponentsResult}
+
+        def expand(tp):
+            expandStart = time.perf_counter()
+            return getResults[tp](entityIds[tp]), time.perf_counter() - expandStart
+
+        futures = {tp: self.__getExecutor().submit(expand, tp) for tp in types}
+        result = {}
+        for tp, future in futures.items():
+            result[tp], timings['metadata'][tp] = future.result()
+        timings['total'] = time.perf_counter() - start
+        return {'result': result, 'timings': timings}
 
     def searchPlots(self, query, top=20, minSim=0.5, indexType='class_predicate'):
+        resultVars = self.__searchEntities(
+            'variable', query, 2000, minSim, indexType)
+        return self.__getPlotsResult(resultVars, top)
+
+    def searchPlotsBatch(self, queries, top=20, minSim=0.5, indexType='class_predicate'):
+        resultVars = self.__searchEntitiesBatch(
+            'variable', queries, 2000, minSim, indexType)
+        return [self.__getPlotsResult(rs, top) for rs in resultVars]
+
+    def __getPlotsResult(self, resultVars, top):
         def getVarDataForPlot(varId):
             varData = {}
             varData['id'] = varId
@@ -264,8 +625,6 @@ class Searcher:
             varData['classes'] = self.getEntityClasses(varId)
             return varData
 
-        resultVars = self.idxVar.searchEntities(
-            query, topK=2000, minSim=minSim, indexType=indexType)
         result = {}
 
         validPlots = []
@@ -303,15 +662,47 @@ class Searcher:
             result[plot] = plotData
         return {'result': result, 'filter': self.__getFilter(result, 'sedml')}
 
-    def searchVariables(self, query, top=20, minSim=0.5, indexType='class_predicate'):
-        results = self.idxVar.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
-        result = [self.getEntityMetadata(varId) for varId in results]
+    def getVariableMask(self, **filters):
+        """Boolean mask over the rows of the variable index, see VariableColumns.mask.
+
+        e.g. getVariableMask(type='state', unit='second')
+        """
+        return self.varColumns.mask(**filters)
+
+    # filters ==> VariableColumns.mask arguments, e.g. {'type': 'state', 'unit': 'second'};
+    # only matching variables are ranked, so a filtered search still returns top results
+    def searchVariables(self, query, top=20, minSim=0.5, indexType='class_predicate', filters=None):
+        rowMask = self.getVariableMask(**filters) if filters else None
+        results = self.__searchEntities(
+            'variable', query, top, minSim, indexType, rowMask)
+        return self.__getVariablesResult(results)
+
+    def searchVariablesBatch(self, queries, top=20, minSim=0.5, indexType='class_predicate', filters=None):
+        rowMask = self.getVariableMask(**filters) if filters else None
+        results = self.__searchEntitiesBatch(
+            'variable', queries, top, minSim, indexType, rowMask)
+        return [self.__getVariablesResult(rs) for rs in results]
+
+    def __getVariablesResult(self, results):
+        if self.resultCards is not None:
+            cards = self.resultCards.getMany(results)
+            result = [card if card is not None else self.getEntityMetadata(varId)
+                      for varId, card in zip(results, cards)]
+        else:
+            result = [self.getEntityMetadata(varId) for varId in results]
         return {'result': result, 'filter': self.__getFilter(result, 'variable')}
 
     def searchCellmls(self, query, top=20, minSim=0.5, indexType='class'):
-        results = self.idxCellml.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
+        results = self.__searchEntities(
+            'cellml', query, top, minSim, indexType)
+        return self.__getCellmlsResult(results)
+
+    def searchCellmlsBatch(self, queries, top=20, minSim=0.5, indexType='class'):
+        results = self.__searchEntitiesBatch(
+            'cellml', queries, top, minSim, indexType)
+        return [self.__getCellmlsResult(rs) for rs in results]
+
+    def __getCellmlsResult(self, results):
         cellmls = []
         for cellmlUrl in results:
             cellml = {'url': PMR_SERVER + cellmlUrl}
@@ -331,8 +722,16 @@ class Searcher:
         return cellmls
 
     def searchSedmls(self, query, top=20, minSim=0.5, indexType='class'):
-        results = self.idxSedml.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
+        results = self.__searchEntities(
+            'sedml', query, top, minSim, indexType)
+        return self.__getSedmlsResult(results)
+
+    def searchSedmlsBatch(self, queries, top=20, minSim=0.5, indexType='class'):
+        results = self.__searchEntitiesBatch(
+            'sedml', queries, top, minSim, indexType)
+        return [self.__getSedmlsResult(rs) for rs in results]
+
+    def __getSedmlsResult(self, results):
         sedmls = []
         for id in results:
             sedml = {'url': PMR_SERVER + self.sysSedmls.getUrl(id)}
@@ -349,11 +748,20 @@ class Searcher:
         return sedmls
 
     def searchImages(self, query, top=20, minSim=0.5, indexType='class'):
-        results = self.idxImage.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
+        results = self.__searchEntities(
+            'image', query, top, minSim, indexType)
+        return self.__getImagesResult(results)
+
+    def searchImagesBatch(self, queries, top=20, minSim=0.5, indexType='class'):
+        results = self.__searchEntitiesBatch(
+            'image', queries, top, minSim, indexType)
+        return [self.__getImagesResult(rs) for rs in results]
+
+    def __getImagesResult(self, results):
         images = []
         for id in results:
-            image = self.sysImages.getData(id)
+            # a copy, the stored image is shared by every search
+            image = dict(self.sysImages.getData(id))
             if len(image) == 0:
                 continue
             workspace = self.sysCellmls.getWorkspace(id=image['cellml'])
@@ -370,8 +778,16 @@ class Searcher:
         return images
 
     def searchComponents(self, query, top=20, minSim=0.5, indexType='class_predicate'):
-        results = self.idxComp.searchEntities(
-            query, topK=top, minSim=minSim, indexType=indexType)
+        results = self.__searchEntities(
+            'component', query, top, minSim, indexType)
+        return self.__getComponentsResult(results)
+
+    def searchComponentsBatch(self, queries, top=20, minSim=0.5, indexType='class_predicate'):
+        results = self.__searchEntitiesBatch(
+            'component', queries, top, minSim, indexType)
+        return [self.__getComponentsResult(rs) for rs in results]
+
+    def __getComponentsResult(self, results):
         components = []
         for id in results:
             metadata = {'id': id, 'math': [], 'classes': {}}
@@ -445,7 +861,9 @@ class Searcher:
 
     def getEntityClasses(self, varId):
         if varId in self.idxVar._entityClasses:
-            return self.idxVar._entityClasses[varId]['classes']
+            # copied, results are handed out while the index is shared
+            return {classId: dict(attr) for classId, attr in
+                    self.idxVar._entityClasses[varId]['classes'].items()}
         return {}
 
     def getComponentCode(self, compId=None, varId=None, format=MATH_FORMAT.CODE):
@@ -463,11 +881,11 @@ class Searcher:
             rs += self.sysVars.getMaths(varId, format)
         return list(set(rs))
 
-    # be careful with getEntityDependencyMaths since it may take a long time
-    # to be executed due to the recursive nature
-    def getEntityDependencyMaths(self, varId, format=MATH_FORMAT.LATEX):
-        varData = {}
-        self.sysVars.getDependents(varId, format, varDep=varData)
+    # maxDepth and maxSize bound the dependency tree of deep models,
+    # maths are only rendered for the returned dependents
+    def getEntityDependencyMaths(self, varId, format=MATH_FORMAT.LATEX, maxDepth=None, maxSize=None):
+        varData = self.sysVars.getDependents(
+            varId, format, maxDepth=maxDepth, maxSize=maxSize)
         for varId, var in varData.items():
             names = var['name'].split('_')
             name = '{'+names[-1]+'}'
@@ -500,17 +918,14 @@ class Searcher:
             tmpImgs = {}
             similarCellmls = self.__getOtherCellms(cellmlId)
             for similarCellml in similarCellmls:
-                cellmlImages += self.__getEntityImages(cellmlUrl=similarCellml)
-                for image in cellmlImages:
+                # merge the meta of an image found in several cellmls into new lists
+                for image in self.__getEntityImages(cellmlUrl=similarCellml):
                     if image['url'] not in tmpImgs:
                         tmpImgs[image['url']] = image
                     else:
-                        tmpImgs[image['url']
-                                ]['meta']['cellml'] += image['meta']['cellml']
-                        tmpImgs[image['url']
-                                ]['meta']['workspace'] += image['meta']['workspace']
-                        tmpImgs[image['url']
-                                ]['meta']['exposure'] += image['meta']['exposure']
+                        meta = tmpImgs[image['url']]['meta']
+                        for key in ['cellml', 'workspace', 'exposure']:
+                            meta[key] = meta[key] + image['meta'][key]
             return list(tmpImgs.values())
         else:
             return cellmlImages
@@ -580,3 +995,7 @@ class Searcher:
             v['classes'] = list(set(v['classes']))
 
         return filter
+
+
+# the encode schedulers and the query cache are reset by encoder.py
+os.register_at_fork(after_in_child=Searcher._resetAfterFork)
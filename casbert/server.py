@@ -0,0 +1,249 @@
+"""Pre-fork HTTP/JSON server of a Searcher.
+
+The parent process loads the model, indexes, backends and collections,
+freezes them out of the garbage collector and forks the workers, so they
+share that memory copy-on-write and adding a worker does not add a copy.
+Each worker accepts on the listening socket of the parent and answers
+requests from a fixed pool of threads, which keep their SQLite connections
+to the collection, result card and math render stores between requests.
+
+Endpoints, parameters as a query string (GET) or a JSON object (POST):
+    /health                  the worker is alive
+    /ready                   the worker can search (503 while shutting down)
+    /search                  Searcher.search, query, top, minSim, indexType, types, filters
+    /search/variables        Searcher.searchVariables, query, top, minSim, indexType, filters
+    /search/cellmls, /search/sedmls, /search/images, /search/components, /search/plots
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from .searcher.searcher import Searcher
+import gc
+import json
+import os
+import signal
+import sys
+import threading
+
+ROUTES = {
+    '/search': 'search',
+    '/search/variables': 'searchVariables',
+    '/search/cellmls': 'searchCellmls',
+    '/search/sedmls': 'searchSedmls',
+    '/search/images': 'searchImages',
+    '/search/components': 'searchComponents',
+    '/search/plots': 'searchPlots',
+}
+
+# variable filters, see VariableColumns.mask
+FILTERS = ['type', 'unit', 'component', 'init', 'rate']
+
+# request parameters passed to the search methods, with their conversion
+PARAMETERS = {
+    'top': int,
+    'minSim': float,
+    'indexType': str,
+    'types': lambda v: v.split(',') if isinstance(v, str) else list(v),
+    'filters': lambda v: json.loads(v) if isinstance(v, str) else dict(v),
+}
+
+
+class SearchServer(HTTPServer):
+    """HTTP server answering requests from a pool of threads.
+
+    A thread per request, as ThreadingHTTPServer does, would open new
+    connections to the SQLite stores for every request, since they are
+    kept per thread. The pool is started on the first request, so in the
+    workers rather than in the parent that forks them.
+    """
+
+    def __init__(self, address, searcher, verbose=False, threads=8):
+        super().__init__(address, SearchRequestHandler)
+        self.searcher = searcher
+        self.verbose = verbose
+        self.threads = threads
+        self.isReady = True
+        self.__pool = None
+
+    def process_request(self, request, clientAddress):
+        if self.__pool is None:
+            self.__pool = ThreadPoolExecutor(self.threads, thread_name_prefix='casbert-request')
+        self.__pool.submit(self.__processRequest, request, clientAddress)
+
+    def __processRequest(self, request, clientAddress):
+        try:
+            self.finish_request(request, clientAddress)
+        except Exception:
+            self.handle_error(request, clientAddress)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self.__pool is not None:
+            # finish the requests being served
+            self.__pool.shutdown(wait=True)
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.__handle(url.path, {k: v[-1] for k, v in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length)) if length > 0 else {}
+        except ValueError as e:
+            return self.__send(400, {'error': 'invalid JSON body: %s' % e})
+        if not isinstance(params, dict):
+            return self.__send(400, {'error': 'the JSON body must be an object'})
+        self.__handle(urlparse(self.path).path, params)
+
+    def __handle(self, path, params):
+        path = path.rstrip('/') or '/'
+        if path == '/health':
+            return self.__send(200, {'status': 'ok', 'pid': os.getpid()})
+        if path == '/ready':
+            if self.server.isReady:
+                return self.__send(200, {'status': 'ready', 'pid': os.getpid()})
+            return self.__send(503, {'status': 'stopping', 'pid': os.getpid()})
+        if path not in ROUTES:
+            return self.__send(404, {'error': 'unknown path %s' % path})
+        query = params.pop('query', None) or params.pop('q', None)
+        if not isinstance(query, str) or len(query.strip()) == 0:
+            return self.__send(400, {'error': 'missing query'})
+        try:
+            kwargs = {name: PARAMETERS[name](value) for name, value in params.items()
+                      if name in PARAMETERS}
+        except (TypeError, ValueError) as e:
+            return self.__send(400, {'error': 'invalid parameter: %s' % e})
+        if path != '/search':
+            kwargs.pop('types', None)
+        if path not in ['/search', '/search/variables']:
+            kwargs.pop('filters', None)
+        error = self.__validate(kwargs)
+        if error is not None:
+            return self.__send(400, {'error': error})
+        try:
+            result = getattr(self.server.searcher, ROUTES[path])(query, **kwargs)
+        except Exception as e:
+            return self.__send(500, {'error': '%s: %s' % (e.__class__.__name__, e)})
+        self.__send(200, result)
+
+    def __validate(self, kwargs):
+        # errors of the caller are answered with 400, not raised by the search as 500
+        searcher = self.server.searcher
+        if kwargs.get('indexType') not in [None, Searcher.IDX_CLASS, Searcher.IDX_CLASS_PREDICATE]:
+            return 'unknown indexType %s, expected %s or %s' % (
+                kwargs['indexType'], Searcher.IDX_CLASS, Searcher.IDX_CLASS_PREDICATE)
+        if 'types' in kwargs:
+            unknown = [tp for tp in kwargs['types'] if tp not in Searcher.SEARCH_TYPES]
+            if len(kwargs['types']) == 0 or len(unknown) > 0:
+                return 'unknown types %s, expected some of %s' % (unknown, list(Searcher.SEARCH_TYPES))
+        if kwargs.get('filters'):
+            if not isinstance(kwargs['filters'], dict):
+                return 'filters must be a JSON object'
+            unknown = [name for name in kwargs['filters'] if name not in FILTERS]
+            if len(unknown) > 0:
+                return 'unknown filters %s, expected some of %s' % (unknown, FILTERS)
+            try:
+                searcher.getVariableMask(**kwargs['filters'])
+            except (TypeError, ValueError) as e:
+                return 'invalid filters: %s' % e
+        return None
+
+    def __send(self, status, content):
+        body = json.dumps(content, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def __runWorker(server, torchThreads):
+    import torch
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    def stop(signum, frame):
+        # answer /ready with 503 and finish the requests being served
+        server.isReady = False
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    gc.enable()
+    torch.set_num_threads(torchThreads)
+    server.serve_forever()
+    server.server_close()
+
+
+def serve(host='127.0.0.1', port=8000, workers=None, torchThreads=1, searcher=None, verbose=False,
+          requestThreads=8, **searcherParams):
+    """Load a Searcher in this process and serve it from forked workers.
+
+    workers ==> worker processes, defaults to the number of cores
+    torchThreads ==> torch threads per worker
+    requestThreads ==> threads answering requests per worker
+    searcher ==> a Searcher to serve, None creates one with searcherParams
+    Returns when the workers have stopped after SIGTERM or SIGINT.
+    """
+    import torch
+    workers = workers if workers is not None else os.cpu_count()
+    # no collection while loading, and torch stays single threaded in the
+    # parent, so its thread pool is not started before the fork
+    gc.disable()
+    torch.set_num_threads(1)
+    searcher = searcher if searcher is not None else Searcher(**searcherParams)
+    searcher.warmup(list(Searcher.WARMUP_TYPES), backends=True)
+    server = SearchServer((host, port), searcher, verbose, requestThreads)
+    # loaded objects leave the collected generations, so collections in the
+    # workers do not write to, and copy, their pages
+    gc.freeze()
+
+    children = set()
+    state = {'isStopping': False}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                __runWorker(server, torchThreads)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        state['isStopping'] = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print('casbert serving http://%s:%d with %d workers' % (host, port, workers))
+    sys.stdout.flush()
+    while len(children) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not state['isStopping']:
+            # a worker died, replace it
+            spawn()
+    server.server_close()
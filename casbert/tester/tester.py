@@ -1,5 +1,4 @@
-# from ..searcher.searcher import Searcher
-from .. import Searcher
+from ..searcher.searcher import Searcher
 from ..general import m_c2p, MATH_FORMAT
 from IPython.display import HTML, Markdown, display
 import logging
@@ -24,4 +24,7 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     package_data={'': ['resources/*', 'sedmlImages/*']},
+    entry_points={
+        'console_scripts': ['casbert=casbert.__main__:main'],
+    },
 )